@@ -1,6 +1,11 @@
 # Imports
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, make_response, stream_with_context, g, has_request_context, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+import sqlalchemy
+from sqlalchemy.orm import defer
+from sqlalchemy.dialects.mysql import LONGTEXT
+from sqlalchemy.orm.attributes import set_committed_value
 from dotenv import load_dotenv
 import os
 from flask_cors import CORS
@@ -8,8 +13,25 @@ from google.oauth2 import id_token
 from google.auth.transport import requests
 from functools import wraps
 import uuid
+import re
+import json
+import zlib
+import hashlib
+import hmac
+import base64
+import threading
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import atexit
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from flask import redirect
-from datetime import date
+from datetime import date, datetime, timezone, timedelta
+import click
 
 # Load the environment variables from the OS
 load_dotenv()
@@ -21,24 +43,111 @@ DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_NAME = os.getenv('DB_NAME')
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')  
+# Optional full SQLAlchemy URI that replaces the mysql one built from the DB_ vars (e.g. sqlite:///bench.db for local runs/benchmarks)
+DATABASE_URI = os.getenv('DATABASE_URI')
+# Connection pool settings, without these we got connection storms under load and
+# "MySQL server has gone away" errors once MySQL closed connections that sat idle past its wait_timeout
+# SQL Alchemy (n.d.) Dealing with Disconnects https://docs.sqlalchemy.org/en/20/core/pooling.html#dealing-with-disconnects
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30')) # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800')) # seconds, keep this under MySQL's wait_timeout
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# Optional read replica, /get-data and /verify-login read from it and everything that writes uses the primary
+# Either a full URI or just the host (+ port) of a replica with the same user/password/db name as the primary
+DB_REPLICA_HOST = os.getenv('DB_REPLICA_HOST')
+DB_REPLICA_PORT = os.getenv('DB_REPLICA_PORT', DB_PORT)
+DATABASE_REPLICA_URI = os.getenv('DATABASE_REPLICA_URI')
+if DATABASE_REPLICA_URI is None and DB_REPLICA_HOST:
+    DATABASE_REPLICA_URI = f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}'
+
+def runningUnderGevent():
+    # True when gevent has monkey patched the socket module (gunicorn's gevent worker does this before loading the app)
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    return gevent_monkey is not None and gevent_monkey.is_module_patched('socket')
+
+def buildEngineOptions(database_uri):
+    engine_options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    database_url = sqlalchemy.engine.make_url(database_uri)
+    # mysql-connector-python uses its C extension when it's installed, and gevent can't patch the C extension's sockets
+    # so every query would block the whole worker (and every other greenlet in it), the pure python one yields properly
+    if database_url.get_driver_name() == 'mysqlconnector' and runningUnderGevent():
+        engine_options["connect_args"] = {"use_pure": True}
+    # in memory sqlite uses a single shared connection (StaticPool) so there's no pool to size
+    if not (database_url.get_backend_name() == 'sqlite' and database_url.database in (None, '', ':memory:')):
+        engine_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return engine_options
+
+#MARK: Read replica routing
+class ReplicaRoutingSession(FlaskSQLAlchemySession):
+    # Sends reads to the 'replica' bind while a route marked with @useReadReplica is running
+    # Anything that writes (flushes, INSERT/UPDATE/DELETE) still goes to the primary
+    # SQL Alchemy (n.d.) Custom Vertical Partitioning https://docs.sqlalchemy.org/en/20/orm/persistence_techniques.html#custom-vertical-partitioning
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None
+                and not self._flushing
+                and not isinstance(clause, sqlalchemy.sql.expression.UpdateBase)
+                and has_app_context()
+                and g.get('use_read_replica')
+                and 'replica' in self._db.engines):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def useReadReplica(f):
+    # Route decorator, reads for the rest of the request go to the replica (if there is one)
+    # Replicas can lag behind a little, so only use this on routes where slightly old data is ok
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.use_read_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+def switchToPrimaryDatabase():
+    # For the odd write inside a replica route (e.g. /get-data creating a brand new user)
+    # the rest of the request goes to the primary too so it reads back what it just wrote
+    if has_app_context():
+        g.use_read_replica = False
 
 # Initiate flask
 app = Flask(__name__)
 # Connect to db using SQL alchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI or f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = buildEngineOptions(app.config['SQLALCHEMY_DATABASE_URI'])
+if DATABASE_REPLICA_URI:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': DATABASE_REPLICA_URI, **buildEngineOptions(DATABASE_REPLICA_URI)}}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': ReplicaRoutingSession})
 # Setup CORS (from Google API docs)
 CORS(app, resources={
     r"/get-data": {"origins": [
         "https://genta.live",
         "http://127.0.0.1:5000",
         "http://localhost:6969"
-    ]},
+    ], "expose_headers": ["ETag"]}, # so the frontend js can read the ETag and send it back in If-None-Match
     r"/update-data": {"origins": [
         "https://genta.live",
         "http://127.0.0.1:5000",
         "http://localhost:6969"
+    ], "expose_headers": ["Retry-After"]}, # so the frontend can back off properly after a 429/503
+    r"/patch-data": {"origins": [
+        "https://genta.live",
+        "http://127.0.0.1:5000",
+        "http://localhost:6969"
+    ], "expose_headers": ["Retry-After"]},
+    r"/changes": {"origins": [
+        "https://genta.live",
+        "http://127.0.0.1:5000",
+        "http://localhost:6969"
+    ]},
+    r"/search": {"origins": [
+        "https://genta.live",
+        "http://127.0.0.1:5000",
+        "http://localhost:6969"
+    ]},
+    r"/session-token": {"origins": [
+        "https://genta.live",
+        "http://127.0.0.1:5000",
+        "http://localhost:6969"
     ]},
     r"/verify-login": {"origins": [ 
         "https://genta.live",
@@ -77,6 +186,9 @@ class User(db.Model):
 # Projects table
 class Project(db.Model):
     __tablename__ = 'projects'
+    # every read/write filters on userId, and the dashboard sorts/filters by dueDate
+    # (the leftmost column of a composite index works on its own too so this covers plain userId lookups)
+    __table_args__ = (db.Index('ix_projects_userId_dueDate', 'userId', 'dueDate'),)
     id = db.Column(db.Integer, primary_key=True)
     userId = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False) # Link to users table!
     projectTitle = db.Column(db.String(255), nullable=False)
@@ -91,6 +203,7 @@ class Project(db.Model):
 #Events table
 class Event(db.Model):
     __tablename__ = 'events'
+    __table_args__ = (db.Index('ix_events_projectId_dueDate', 'projectId', 'dueDate'),)
     id = db.Column(db.Integer, primary_key=True)
     projectId = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False) # Foreign Key to projects table
     title = db.Column(db.String(255), nullable=False)
@@ -109,6 +222,7 @@ class Event(db.Model):
 # Todos table
 class Todo(db.Model):
     __tablename__ = 'todos'
+    __table_args__ = (db.Index('ix_todos_eventId', 'eventId'),)
     id = db.Column(db.Integer, primary_key=True)
     eventId = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=False) 
     checked = db.Column(db.Boolean, nullable=False, default=False)
@@ -117,15 +231,652 @@ class Todo(db.Model):
     def __repr__(self):
         return f'<Todo {self.content}>'
 
+# Materialized /get-data document for each user (see the Materialized snapshots section)
+class UserSnapshot(db.Model):
+    __tablename__ = 'user_snapshots'
+    userId = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    versionTag = db.Column(db.String(255), nullable=False) # the users.versionTag this document was built at
+    document = db.Column(db.Text().with_variant(LONGTEXT(), 'mysql'), nullable=False) # plain TEXT is only 64KB on mysql
+    updatedAt = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.userId} {self.versionTag}>'
+
+
+
+
+#MARK: Migrations
+# db.create_all() only ever creates missing tables, it never changes ones that already exist,
+# so schema changes for the live database go here as numbered migrations instead
+# Run them with:  flask --app app migrate          (apply everything that hasn't been applied yet)
+#                 flask --app app migrate --status (just list them)
+# Applied versions are stored in the schema_migrations table. Every migration has to be safe to run
+# on a database that already has the change (e.g. one made by create_all) since it'll just be recorded as applied
+# MySQL (n.d.) Online DDL Operations https://dev.mysql.com/doc/refman/8.0/en/innodb-online-ddl-operations.html
+schema_migrations_table = sqlalchemy.Table(
+    'schema_migrations', sqlalchemy.MetaData(),
+    sqlalchemy.Column('version', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('name', sqlalchemy.String(255), nullable=False),
+    sqlalchemy.Column('appliedAt', sqlalchemy.DateTime, nullable=False),
+)
+
+def createIndexOnline(connection, table_name, index_name, column_names, fulltext=False):
+    # Adds an index to a live table without rebuilding it (or locking writes on MySQL)
+    # (MySQL can't build a FULLTEXT index with writes still going, so those block writes but not reads while they build)
+    existing_index_names = {index['name'] for index in sqlalchemy.inspect(connection).get_indexes(table_name)}
+    if index_name in existing_index_names:
+        return False
+    quote = connection.dialect.identifier_preparer.quote
+    columns_sql = ', '.join(quote(column_name) for column_name in column_names)
+    create_sql = f'CREATE {"FULLTEXT " if fulltext else ""}INDEX {quote(index_name)} ON {quote(table_name)} ({columns_sql})'
+    if connection.dialect.name == 'mysql':
+        create_sql += ' ALGORITHM=INPLACE LOCK=SHARED' if fulltext else ' ALGORITHM=INPLACE LOCK=NONE'
+    connection.exec_driver_sql(create_sql)
+    return True
+
+def migrationAddForeignKeyIndexes(connection):
+    createIndexOnline(connection, 'projects', 'ix_projects_userId_dueDate', ['userId', 'dueDate'])
+    createIndexOnline(connection, 'events', 'ix_events_projectId_dueDate', ['projectId', 'dueDate'])
+    createIndexOnline(connection, 'todos', 'ix_todos_eventId', ['eventId'])
+
+def migrationAddUserSnapshots(connection):
+    # new table so nothing is locked, documents get filled in by `flask rebuild-snapshots`
+    UserSnapshot.__table__.create(connection, checkfirst=True)
+
+def migrationAddFullTextSearch(connection):
+    # MySQL: FULLTEXT indexes, InnoDB keeps them up to date itself as part of every insert/update/delete
+    # SQLite: FTS5 tables that point at events/todos (external content, so the text isn't stored twice)
+    # plus triggers that keep them in step. The triggers run inside the same statement as the write, so every
+    # write path (editDatabase's batched Core inserts, ORM updates, cascade deletes, /patch-data, import-data) is covered
+    # SQLite (n.d.) FTS5 External Content Tables https://www.sqlite.org/fts5.html#external_content_tables
+    if connection.dialect.name == 'mysql':
+        createIndexOnline(connection, 'events', 'ft_events_title_notes', ['title', 'notes'], fulltext=True)
+        createIndexOnline(connection, 'todos', 'ft_todos_content', ['content'], fulltext=True)
+    elif connection.dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_SCHEMA:
+            connection.exec_driver_sql(statement)
+        # fill them from what's already in the tables
+        connection.exec_driver_sql("INSERT INTO events_fts(events_fts) VALUES ('rebuild')")
+        connection.exec_driver_sql("INSERT INTO todos_fts(todos_fts) VALUES ('rebuild')")
+
+SQLITE_SEARCH_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(title, notes, content='events', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+        INSERT INTO events_fts(rowid, title, notes) VALUES (new.id, new.title, new.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+        INSERT INTO events_fts(events_fts, rowid, title, notes) VALUES ('delete', old.id, old.title, old.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE OF title, notes ON events BEGIN
+        INSERT INTO events_fts(events_fts, rowid, title, notes) VALUES ('delete', old.id, old.title, old.notes);
+        INSERT INTO events_fts(rowid, title, notes) VALUES (new.id, new.title, new.notes);
+    END""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS todos_fts USING fts5(content, content='todos', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS todos_fts_insert AFTER INSERT ON todos BEGIN
+        INSERT INTO todos_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS todos_fts_delete AFTER DELETE ON todos BEGIN
+        INSERT INTO todos_fts(todos_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS todos_fts_update AFTER UPDATE OF content ON todos BEGIN
+        INSERT INTO todos_fts(todos_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO todos_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+)
+
+# (version, name, function) - only ever add to the end of this list!
+MIGRATIONS = [
+    (1, 'add foreign key hot path indexes', migrationAddForeignKeyIndexes),
+    (2, 'add user_snapshots table', migrationAddUserSnapshots),
+    (3, 'add full text search indexes', migrationAddFullTextSearch),
+]
+
+def getAppliedMigrationVersions(connection):
+    schema_migrations_table.create(connection, checkfirst=True)
+    return {row.version for row in connection.execute(sqlalchemy.select(schema_migrations_table.c.version))}
+
+def runMigrations(engine):
+    # Each migration gets its own transaction so a failure leaves the earlier ones recorded
+    # (note MySQL commits DDL straight away anyway)
+    applied_now = []
+    with engine.begin() as connection:
+        applied_versions = getAppliedMigrationVersions(connection)
+    for version, name, migration in MIGRATIONS:
+        if version in applied_versions:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(schema_migrations_table.insert().values(version=version, name=name, appliedAt=datetime.now(timezone.utc).replace(tzinfo=None)))
+        applied_now.append((version, name))
+    return applied_now
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='List the migrations and whether they have been applied, without applying anything.')
+def migrateCommand(status):
+    """Apply any schema migrations that haven't been applied yet."""
+    if status:
+        with db.engine.begin() as connection:
+            applied_versions = getAppliedMigrationVersions(connection)
+        for version, name, _ in MIGRATIONS:
+            click.echo(f"{version:>4}  {'applied' if version in applied_versions else 'pending':<8} {name}")
+        return
+    applied_now = runMigrations(db.engine)
+    for version, name in applied_now:
+        click.echo(f"applied {version}: {name}")
+    if not applied_now:
+        click.echo("database is up to date")
+
+
+
+
+#MARK: Logging
+# Structured (one JSON object per line) logging instead of print()
+# print() writes to stdout right there in the request thread, and some of them ran once per todo while the
+# save's transaction was open. Now records go into a queue and a background thread does the actual writing
+# Every record gets the request's correlation id (X-Request-ID from the client/load balancer, or a new one)
+# DEBUG records are sampled (LOG_DEBUG_SAMPLE_RATE) so turning on debug in prod doesn't flood anything
+# Python (n.d.) Dealing with handlers that block https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+class JSONLogFormatter(logging.Formatter):
+    def format(self, record):
+        log_record = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "event": record.getMessage(),
+            "request_id": getattr(record, 'request_id', None),
+        }
+        log_record.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            log_record["exception"] = self.formatException(record.exc_info)
+        return json.dumps(log_record, default=str)
+
+class RequestContextFilter(logging.Filter):
+    # runs in the request's own thread, before the record is queued, so g is still there
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+class DebugSamplingFilter(logging.Filter):
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.sample_rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # If the writer thread can't keep up, drop records (and count them) instead of blocking requests
+    # The record is formatted here, in the request thread, so the queue only ever holds finished strings
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        formatted_record = logging.makeLogRecord({"msg": self.format(record), "levelno": record.levelno, "levelname": record.levelname})
+        return formatted_record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+log_queue_handler = DroppingQueueHandler(log_queue)
+log_queue_handler.setFormatter(JSONLogFormatter())
+log_queue_handler.addFilter(RequestContextFilter())
+log_queue_handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+log_output_handler = logging.StreamHandler(sys.stdout)
+log_output_handler.setFormatter(logging.Formatter('%(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_output_handler)
+log_listener.start()
+atexit.register(log_listener.stop) # writes out whatever is still queued when the process exits
+
+logger = logging.getLogger('genta')
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(log_queue_handler)
+logger.propagate = False
+
+def logEvent(level, event, **fields):
+    # logEvent(logging.INFO, "save", user_db_id=1, created=3) -> {"event": "save", "user_db_id": 1, "created": 3, ...}
+    if logger.isEnabledFor(level):
+        exc_info = fields.pop('exc_info', None) # an exception to attach the traceback of
+        logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+@app.before_request
+def assignRequestId():
+    # keep the caller's id if it sent a sensible one so logs line up across services
+    incoming_request_id = request.headers.get(REQUEST_ID_HEADER, '')
+    if 0 < len(incoming_request_id) <= 64 and all(character.isalnum() or character in '-_.' for character in incoming_request_id):
+        g.request_id = incoming_request_id
+    else:
+        g.request_id = uuid.uuid4().hex
+
+@app.after_request
+def addRequestIdHeader(response):
+    response.headers[REQUEST_ID_HEADER] = g.get('request_id', '')
+    return response
+
+
+
+
+#MARK: Metrics
+# Per request timing + SQL counting, exposed in the Prometheus text format at /metrics
+# Every request records how long it took and how many statements it ran, and the big steps
+# (token verification, tree load, diff, commit) get their own timings through timedPhase()
+# Prometheus (n.d.) Exposition formats https://prometheus.io/docs/instrumenting/exposition_formats/
+SLOW_REQUEST_LOG_MS = float(os.getenv('SLOW_REQUEST_LOG_MS', '0')) # 0 = slow request log is off
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') # if set /metrics needs "Authorization: Bearer <METRICS_TOKEN>"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {} # label values -> [count per bucket, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for bucket_index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series[0][bucket_index] += 1 # buckets are cumulative in prometheus
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, (bucket_counts, total, count) in sorted(self.series.items()):
+                labels = formatMetricLabels(self.label_names, label_values)
+                for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{upper_bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{labels}}} {total}')
+                lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+def formatMetricLabels(label_names, label_values):
+    # label values need \, " and newlines escaped
+    escaped_values = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in label_values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(label_names, escaped_values))
+
+request_duration_histogram = Histogram('genta_request_duration_seconds', 'Time spent handling a request (not counting streamed bodies).', ('route', 'method', 'status'), LATENCY_BUCKETS)
+request_sql_statements_histogram = Histogram('genta_request_sql_statements', 'SQL statements run per request.', ('route',), STATEMENT_COUNT_BUCKETS)
+request_sql_duration_histogram = Histogram('genta_request_sql_duration_seconds', 'Time spent waiting on SQL per request.', ('route',), LATENCY_BUCKETS)
+phase_duration_histogram = Histogram('genta_phase_duration_seconds', 'Time spent in each step of a request.', ('phase',), LATENCY_BUCKETS)
+
+@contextmanager
+def timedPhase(phase_name):
+    # Works as a `with timedPhase("commit"):` block or as a @timedPhase("diff") decorator
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        phase_duration_histogram.observe(elapsed, phase_name)
+        if has_request_context():
+            g.phase_timings.append((phase_name, elapsed))
+
+# SQLAlchemy events fire for every statement on every engine, they get added to the current request's list
+# SQL Alchemy (n.d.) Profiling https://docs.sqlalchemy.org/en/20/faq/performance.html#query-profiling
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'before_cursor_execute')
+def beforeCursorExecute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'after_cursor_execute')
+def afterCursorExecute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_times'].pop()
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements.append((statement, elapsed))
+
+@app.before_request
+def startRequestMetrics():
+    g.request_started = time.perf_counter()
+    g.sql_statements = []
+    g.phase_timings = []
+
+@app.after_request
+def recordRequestMetrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    # use the route pattern not the actual path so random urls can't blow up the number of series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    sql_time = sum(duration for _, duration in g.sql_statements)
+    request_duration_histogram.observe(elapsed, route, request.method, response.status_code)
+    request_sql_statements_histogram.observe(len(g.sql_statements), route)
+    request_sql_duration_histogram.observe(sql_time, route)
+
+    logEvent(logging.INFO, "request", method=request.method, route=route, status=response.status_code,
+             duration_ms=round(elapsed * 1000, 1), sql_statements=len(g.sql_statements), sql_ms=round(sql_time * 1000, 1))
+    # dump everything the slow request did so we can see where the time went
+    if SLOW_REQUEST_LOG_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_LOG_MS:
+        logEvent(logging.WARNING, "slow_request", method=request.method, route=route, status=response.status_code,
+                 duration_ms=round(elapsed * 1000, 1), sql_ms=round(sql_time * 1000, 1),
+                 phases=[{"phase": phase_name, "ms": round(phase_elapsed * 1000, 1)} for phase_name, phase_elapsed in g.phase_timings],
+                 sql=[{"ms": round(statement_elapsed * 1000, 1), "statement": ' '.join(statement.split())} for statement, statement_elapsed in g.sql_statements])
+    return response
+
+def renderMetrics():
+    lines = []
+    for histogram in (request_duration_histogram, request_sql_statements_histogram, request_sql_duration_histogram, phase_duration_histogram):
+        lines.extend(histogram.render())
+
+    # the cache counters from the google token + snapshot caches, and how much compression is saving
+    for stat_name, value in google_auth_cache_stats.items():
+        lines.append(f"# TYPE genta_google_auth_{stat_name}_total counter")
+        lines.append(f"genta_google_auth_{stat_name}_total {value}")
+    for stat_name, value in compression_stats.items():
+        lines.append(f"# TYPE genta_compression_{stat_name}_total counter")
+        lines.append(f"genta_compression_{stat_name}_total {value}")
+    lines.append("# TYPE genta_admission_shed_total counter")
+    with admission_shed_counts_lock:
+        for (route_name, reason), count in sorted(admission_shed_counts.items()):
+            lines.append(f'genta_admission_shed_total{{{formatMetricLabels(("route", "reason"), (route_name, reason))}}} {count}')
+    lines.append("# TYPE genta_admission_queue_waiting gauge")
+    lines.append(f"genta_admission_queue_waiting {admission_queue.waiting}")
+    lines.append("# TYPE genta_log_records_dropped_total counter")
+    lines.append(f"genta_log_records_dropped_total {log_queue_handler.dropped}")
+    lines.append("# TYPE genta_change_subscribers gauge")
+    lines.append(f"genta_change_subscribers {change_broker.subscriber_count()}")
+    for stat_name, value in session_token_stats.items():
+        lines.append(f"# TYPE genta_session_tokens_{stat_name}_total counter")
+        lines.append(f"genta_session_tokens_{stat_name}_total {value}")
+    snapshot_stats = snapshot_cache.stats()
+    for stat_name, metric_type in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("compressed_hits", "counter"), ("entries", "gauge"), ("bytes", "gauge"), ("max_bytes", "gauge"), ("hit_rate", "gauge")):
+        metric_name = f"genta_snapshot_cache_{stat_name}" + ("_total" if metric_type == "counter" else "")
+        lines.append(f"# TYPE {metric_name} {metric_type}")
+        lines.append(f"{metric_name} {snapshot_stats[stat_name]}")
+    return '\n'.join(lines) + '\n'
+
+
+
+
+#MARK: Compression
+# The tree JSON repeats the same keys ("notesShown", "todoShown"...) over and over so it compresses really well
+# Responses get gzip/brotli/zstd depending on what the client's Accept-Encoding says and what's installed
+# (brotli needs `pip install Brotli`, zstd needs `pip install zstandard`, gzip always works)
+# and /update-data + /patch-data accept "Content-Encoding: gzip" bodies
+# CORS: flask-cors allows any request header by default so the Content-Encoding preflight just works,
+# and browsers decode Content-Encoding themselves so nothing extra has to be exposed
+# MDN (n.d.) Content-Encoding https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Content-Encoding
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024')) # smaller than this isn't worth the cpu (or the header bytes)
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5')) # 11 is way too slow to do on every request
+ZSTD_LEVEL = int(os.getenv('ZSTD_LEVEL', '3'))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain')
+# Decompression bomb limits for request bodies, a few KB of gzip can decompress into gigabytes
+REQUEST_MAX_COMPRESSED_BYTES = int(os.getenv('REQUEST_MAX_COMPRESSED_BYTES', str(10 * 1024 * 1024)))
+REQUEST_MAX_DECOMPRESSED_BYTES = int(os.getenv('REQUEST_MAX_DECOMPRESSED_BYTES', str(50 * 1024 * 1024)))
+
+# best first, used to break ties when the client likes several equally
+RESPONSE_ENCODINGS = [encoding for encoding, available in (('zstd', zstandard is not None), ('br', brotli is not None), ('gzip', True)) if available]
+compression_stats = {"responses": 0, "bytes_in": 0, "bytes_out": 0}
+compression_stats_lock = threading.Lock()
+
+class ResponseCompressor:
+    # Same interface for the 3 libraries, compress() returns whatever output is ready (flushed so streamed chunks
+    # reach the client straight away instead of sitting in the compressor), finish() ends the stream
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # 16+ = gzip header
+        elif encoding == 'br':
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data, flush=True):
+        if self.encoding == 'br':
+            output = self.compressor.process(data)
+            return output + self.compressor.flush() if flush else output
+        output = self.compressor.compress(data)
+        if not flush:
+            return output
+        if self.encoding == 'gzip':
+            return output + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return output + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+def recordCompression(bytes_in, bytes_out):
+    with compression_stats_lock:
+        compression_stats["responses"] += 1
+        compression_stats["bytes_in"] += bytes_in
+        compression_stats["bytes_out"] += bytes_out
+
+def compressChunks(chunks, encoding):
+    # for streamed responses, compress each chunk as it comes out of the generator
+    compressor = ResponseCompressor(encoding)
+    bytes_in = bytes_out = 0
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        bytes_in += len(chunk)
+        bytes_out += len(compressed_chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+    last_chunk = compressor.finish()
+    recordCompression(bytes_in, bytes_out + len(last_chunk))
+    yield last_chunk
+
+def compressBody(body, encoding):
+    with timedPhase('compress'):
+        compressor = ResponseCompressor(encoding)
+        compressed_body = compressor.compress(body, flush=False) + compressor.finish()
+    recordCompression(len(body), len(compressed_body))
+    return compressed_body
+
+def pickResponseEncoding(body_size):
+    # The encoding compressResponse would use for a body this big, or None to send it as is
+    if body_size < COMPRESSION_MIN_BYTES:
+        return None
+    return request.accept_encodings.best_match(RESPONSE_ENCODINGS)
+
+@app.after_request
+def compressResponse(response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    # shared caches have to keep the compressed and uncompressed copies apart
+    response.vary.add('Accept-Encoding')
+    # Responses that already have a Content-Encoding (e.g. /get-data bodies compressed once and kept in snapshot_cache) go out as they are
+    if (response.status_code < 200 or response.status_code in (204, 304) or request.method == 'HEAD'
+            or 'Content-Encoding' in response.headers or response.direct_passthrough):
+        return response
+    encoding = request.accept_encodings.best_match(RESPONSE_ENCODINGS)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # size isn't known up front, but anything worth streaming is big enough to compress
+        response.response = compressChunks(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESSION_MIN_BYTES:
+            return response
+        response.set_data(compressBody(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed bytes aren't the same bytes as the uncompressed ones, so a strong ETag
+    # would be wrong here. /get-data compares weakly so the 304s still work
+    # RFC 9110 (2022) 8.8.3 ETag https://www.rfc-editor.org/rfc/rfc9110#name-etag
+    etag, is_weak = response.get_etag()
+    if etag is not None and not is_weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def readRequestJSON():
+    # request.get_json() but it also understands "Content-Encoding: gzip" bodies
+    # Returns (data, None) or (None, (error message, status code))
+    content_encoding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+    if content_encoding == 'identity':
+        return request.get_json(silent=True), None
+    if content_encoding != 'gzip':
+        return None, (f"Unsupported Content-Encoding {content_encoding}", 415)
+
+    if request.content_length is not None and request.content_length > REQUEST_MAX_COMPRESSED_BYTES:
+        return None, ("Request body too large", 413)
+    compressed_body = request.stream.read(REQUEST_MAX_COMPRESSED_BYTES + 1)
+    if len(compressed_body) > REQUEST_MAX_COMPRESSED_BYTES:
+        return None, ("Request body too large", 413)
+
+    # max_length stops the decompressor as soon as the output goes over the limit,
+    # so a bomb never gets fully inflated into memory
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        body = decompressor.decompress(compressed_body, REQUEST_MAX_DECOMPRESSED_BYTES + 1)
+    except zlib.error:
+        return None, ("Invalid gzip data", 400)
+    if len(body) > REQUEST_MAX_DECOMPRESSED_BYTES:
+        return None, ("Request body too large once decompressed", 413)
+    if not decompressor.eof:
+        return None, ("Invalid gzip data", 400)
+    try:
+        return json.loads(body), None
+    except ValueError:
+        return None, None
+
 
 
 
 #MARK: Google IdP
+# Caching for the google sign in stuff
+# Before this every single request made a brand new transport, (possibly) redownloaded google's certs and did the RSA check again
+# Now there is one transport for the whole process, the certs are kept for as long as google says (Cache-Control max-age)
+# and tokens that already passed are remembered until they expire so the same bearer token skips the crypto entirely
+GOOGLE_CERTS_URL = os.getenv('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv('VERIFIED_TOKEN_CACHE_SIZE', '10000'))
+
+# hit/miss counters so we can actually see if the caches are doing anything
+google_auth_cache_stats = {
+    "cert_hits": 0,
+    "cert_misses": 0,
+    "token_hits": 0,
+    "token_misses": 0,
+}
+
+class CachedCertsRequest:
+    # Wraps a google.auth transport and keeps GET responses (the cert endpoint) until their max-age runs out
+    # Anything with the same call signature as google.auth.transport.Request can be passed in,
+    # so tests can swap in a fake cert endpoint that serves a locally generated key pair
+    def __init__(self, transport):
+        self.transport = transport
+        self.cached_responses = {} # url -> (expires_at, response)
+        self.lock = threading.Lock()
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=None, **kwargs):
+        if method != 'GET':
+            return self.transport(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+        with self.lock:
+            cached = self.cached_responses.get(url)
+            if cached is not None and cached[0] > time.monotonic():
+                google_auth_cache_stats["cert_hits"] += 1
+                return cached[1]
+            google_auth_cache_stats["cert_misses"] += 1
+
+        response = self.transport(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+        if response.status == 200:
+            max_age = getMaxAgeFromHeaders(response.headers)
+            if max_age > 0:
+                with self.lock:
+                    self.cached_responses[url] = (time.monotonic() + max_age, response)
+        return response
+
+    def clear(self):
+        with self.lock:
+            self.cached_responses.clear()
+
+def getMaxAgeFromHeaders(headers):
+    # Cache-Control looks like "public, max-age=19523, must-revalidate, no-transform"
+    # MDN (n.d.) Cache-Control https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
+    cache_control = headers.get('Cache-Control') or headers.get('cache-control') or ''
+    for directive in cache_control.split(','):
+        directive = directive.strip().lower()
+        if directive in ('no-store', 'no-cache'):
+            return 0
+        if directive.startswith('max-age='):
+            try:
+                return max(int(directive[len('max-age='):]), 0)
+            except ValueError:
+                return 0
+    return 0
+
+class VerifiedTokenCache:
+    # A bounded LRU of tokens that already passed verification
+    # Keyed by a sha256 of the token (so the raw tokens aren't sitting in memory) and dropped once the token's exp passes
+    # Python docs (n.d.) OrderedDict https://docs.python.org/3/library/collections.html#collections.OrderedDict
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict() # token hash -> (exp, user_info)
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        with self.lock:
+            entry = self.entries.get(token_hash)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                # token has expired, kick it out
+                del self.entries[token_hash]
+                return None
+            self.entries.move_to_end(token_hash)
+            return dict(entry[1])
+
+    def put(self, token, exp, user_info):
+        if self.max_size <= 0:
+            return
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        with self.lock:
+            self.entries[token_hash] = (exp, dict(user_info))
+            self.entries.move_to_end(token_hash)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False) # drop the least recently used
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# One of each for the whole process
+google_request = CachedCertsRequest(requests.Request())
+verified_token_cache = VerifiedTokenCache(VERIFIED_TOKEN_CACHE_SIZE)
+
 # Vendor provided code (Google Identity)
 def verify_google_token(token):
     """Verifies the Google ID token."""
+    cached_user_info = verified_token_cache.get(token)
+    if cached_user_info is not None:
+        google_auth_cache_stats["token_hits"] += 1
+        return cached_user_info
+    google_auth_cache_stats["token_misses"] += 1
+
     try:
-        idinfo = id_token.verify_oauth2_token(token, requests.Request(), GOOGLE_CLIENT_ID)
+        idinfo = id_token.verify_token(token, google_request, audience=GOOGLE_CLIENT_ID, certs_url=GOOGLE_CERTS_URL)
 
         if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
             raise ValueError('Wrong issuer.')
@@ -135,11 +886,86 @@ def verify_google_token(token):
         user_id = idinfo['sub']
         email = idinfo['email']
         # You might want to verify the 'aud' (audience) matches your client ID
-        return {'user_id': user_id, 'email': email}
+        user_info = {'user_id': user_id, 'email': email}
+        verified_token_cache.put(token, idinfo['exp'], user_info)
+        return user_info
     except ValueError:
         # Invalid token
         return None
 
+#MARK: Session tokens
+# Checking a Google ID token is an RSA signature check (plus the googleId lookup in every route after it),
+# and the frontend sends the same token to /verify-login, /get-data etc. one after the other
+# So the client can swap the Google token for a session token once at /session-token, signed by us with HMAC-SHA256
+# It carries the sub and users.id, so checking it is one HMAC and the routes can skip the googleId lookup
+# Format: gs1.<base64url JSON payload>.<base64url signature>  (Google tokens are JWTs and start with "eyJ" so they can't clash)
+# SESSION_TOKEN_KEYS is "keyid:secret,keyid:secret,..." - the first key signs new tokens and every key is accepted.
+# To rotate, put the new key first, then remove the old one once SESSION_TOKEN_TTL_SECONDS has passed
+# There's no revocation list, so keep the TTL short (they're only worth anything for a few back to back calls anyway)
+# RFC 2104 (1997) HMAC https://www.rfc-editor.org/rfc/rfc2104
+SESSION_TOKEN_PREFIX = 'gs1.'
+SESSION_TOKEN_TTL_SECONDS = int(os.getenv('SESSION_TOKEN_TTL_SECONDS', '900'))
+
+def parseSessionTokenKeys(keys_setting):
+    # Returns [(key id, secret bytes), ...] with the signing key first
+    session_token_keys = []
+    for key_entry in filter(None, (entry.strip() for entry in keys_setting.split(','))):
+        key_id, separator, secret = key_entry.partition(':')
+        if not separator or not key_id or len(secret) < 32:
+            raise RuntimeError("SESSION_TOKEN_KEYS entries have to look like keyid:secret with a secret of at least 32 characters")
+        session_token_keys.append((key_id, secret.encode()))
+    return session_token_keys
+
+SESSION_TOKEN_KEYS = parseSessionTokenKeys(os.getenv('SESSION_TOKEN_KEYS', ''))
+session_token_stats = {"issued": 0, "verified": 0, "rejected": 0}
+
+def encodeBase64URL(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def decodeBase64URL(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def signSessionTokenPayload(payload_part, secret):
+    return encodeBase64URL(hmac.new(secret, (SESSION_TOKEN_PREFIX + payload_part).encode(), hashlib.sha256).digest())
+
+def issueSessionToken(user_google_id, user_db_id):
+    key_id, secret = SESSION_TOKEN_KEYS[0]
+    issued_at = int(time.time())
+    payload = {"sub": user_google_id, "uid": user_db_id, "iat": issued_at, "exp": issued_at + SESSION_TOKEN_TTL_SECONDS, "kid": key_id}
+    payload_part = encodeBase64URL(encodeJSON(payload).encode())
+    session_token_stats["issued"] += 1
+    return f"{SESSION_TOKEN_PREFIX}{payload_part}.{signSessionTokenPayload(payload_part, secret)}"
+
+def verifySessionToken(token):
+    # Returns user_info like verify_google_token does (plus user_db_id), or None
+    try:
+        payload_part, signature_part = token[len(SESSION_TOKEN_PREFIX):].split('.')
+        payload = json.loads(decodeBase64URL(payload_part))
+        secret = dict(SESSION_TOKEN_KEYS).get(payload["kid"])
+        # compare_digest so the time taken doesn't leak how much of the signature was right
+        if secret is None or not hmac.compare_digest(signSessionTokenPayload(payload_part, secret), signature_part):
+            raise ValueError('Bad signature.')
+        if payload["exp"] <= time.time():
+            raise ValueError('Expired.')
+        session_token_stats["verified"] += 1
+        return {'user_id': payload["sub"], 'user_db_id': payload["uid"], 'token_type': 'session'}
+    except (ValueError, KeyError, TypeError):
+        session_token_stats["rejected"] += 1
+        return None
+
+def lookupUserRecord(user_info):
+    # Session tokens already know users.id so that's a primary key read instead of the googleId lookup
+    if user_info.get('user_db_id') is not None:
+        return db.session.get(User, user_info['user_db_id'])
+    return User.query.filter_by(googleId=user_info['user_id']).first()
+
+def lookupUserDbId(user_info):
+    # For routes that only need the id, with a session token this doesn't touch the db at all
+    if user_info.get('user_db_id') is not None:
+        return user_info['user_db_id']
+    user_record = User.query.filter_by(googleId=user_info['user_id']).first()
+    return user_record.id if user_record is not None else None
+
 # Vendor provided code (Google Identity)
 def token_required(f):
     """Decorator to require a valid Google ID token for accessing a route."""
@@ -148,7 +974,12 @@ def token_required(f):
         auth_header = request.headers.get('Authorization')
         if auth_header and auth_header.startswith('Bearer '):
             id_token_str = auth_header.split(' ')[1]
-            user_info = verify_google_token(id_token_str)
+            with timedPhase('verify_token'):
+                # session tokens from /session-token are checked locally, anything else has to be a Google ID token
+                if SESSION_TOKEN_KEYS and id_token_str.startswith(SESSION_TOKEN_PREFIX):
+                    user_info = verifySessionToken(id_token_str)
+                else:
+                    user_info = verify_google_token(id_token_str)
             if user_info:
                 # Optionally pass the user_info to the route if needed
                 return f(user_info=user_info, *args, **kwargs) # Pass the user_info var to the decorated func
@@ -161,27 +992,256 @@ def token_required(f):
 
 
 
+#MARK: Admission control
+# Stops one client stuck in a retry loop (or a burst of saves from everyone) from taking every worker and db connection
+# Checked in this order, after token_required so we know whose request it is:
+#  1. token bucket per Google sub: ADMISSION_USER_RATE saves/second, bursts of up to ADMISSION_USER_BURST -> 429
+#  2. at most ADMISSION_USER_MAX_CONCURRENT saves running at once per Google sub -> 429
+#  3. at most ADMISSION_MAX_ACTIVE saves running at once in this process, ADMISSION_MAX_QUEUE more can wait
+#     up to ADMISSION_QUEUE_TIMEOUT seconds for a slot, anything past that is turned away straight away -> 503
+# Every rejection has a Retry-After header and is counted on /metrics
+# 1 and 2 go through admission_backend. The in-process one only sees its own worker, set ADMISSION_REDIS_URL
+# (needs `pip install redis`) to share the limits between all the workers. 3 is always per process since
+# it's protecting this process's own threads and connection pool
+# MDN (n.d.) Retry-After https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Retry-After
+try:
+    import redis
+except ImportError:
+    redis = None
+
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'true').lower() == 'true'
+ADMISSION_USER_RATE = float(os.getenv('ADMISSION_USER_RATE', '2'))
+ADMISSION_USER_BURST = float(os.getenv('ADMISSION_USER_BURST', '10'))
+ADMISSION_USER_MAX_CONCURRENT = int(os.getenv('ADMISSION_USER_MAX_CONCURRENT', '2'))
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', str(DB_POOL_SIZE))) # more than the pool would just queue on the pool
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', str(DB_POOL_SIZE * 4)))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '2'))
+ADMISSION_REDIS_URL = os.getenv('ADMISSION_REDIS_URL')
+
+class InProcessAdmissionBackend:
+    MAX_BUCKETS = 10000 # full buckets get thrown away past this so memory doesn't grow forever
+
+    def __init__(self):
+        self.buckets = {} # key -> [tokens, last refill time]
+        self.running = {} # key -> requests running right now
+        self.lock = threading.Lock()
+
+    def take_token(self, key, rate, burst):
+        # Returns 0 if the request can go ahead, otherwise how many seconds until it could
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.MAX_BUCKETS:
+                    self._prune(now, rate, burst)
+                bucket = self.buckets[key] = [burst, now]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+    def _prune(self, now, rate, burst):
+        # lock has to already be held, a bucket that would be full again is the same as no bucket
+        for key, (tokens, last_refill) in list(self.buckets.items()):
+            if tokens + (now - last_refill) * rate >= burst:
+                del self.buckets[key]
+
+    def acquire_slot(self, key, limit):
+        with self.lock:
+            if self.running.get(key, 0) >= limit:
+                return False
+            self.running[key] = self.running.get(key, 0) + 1
+            return True
+
+    def release_slot(self, key):
+        with self.lock:
+            self.running[key] -= 1
+            if self.running[key] <= 0:
+                del self.running[key]
+
+class RedisAdmissionBackend:
+    # Same thing with the state in redis so every worker shares it
+    # The bucket is updated by a lua script so the read + write can't interleave between workers
+    # Redis (n.d.) Scripting with Lua https://redis.io/docs/latest/develop/interact/programmability/eval-intro/
+    TOKEN_BUCKET_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'refilled')
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local refilled = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - refilled) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'refilled', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+    SLOT_EXPIRE_SECONDS = 300 # if a worker dies holding a slot it comes back after this
+
+    def __init__(self, redis_url):
+        self.client = redis.Redis.from_url(redis_url)
+        self.token_bucket = self.client.register_script(self.TOKEN_BUCKET_SCRIPT)
+
+    def take_token(self, key, rate, burst):
+        # lua numbers get cut to integers on the way out, hence the string
+        return float(self.token_bucket(keys=[f'genta:bucket:{key}'], args=[rate, burst, time.time()]))
+
+    def acquire_slot(self, key, limit):
+        slot_key = f'genta:running:{key}'
+        pipeline = self.client.pipeline()
+        pipeline.incr(slot_key)
+        pipeline.expire(slot_key, self.SLOT_EXPIRE_SECONDS)
+        running, _ = pipeline.execute()
+        if running > limit:
+            self.client.decr(slot_key)
+            return False
+        return True
+
+    def release_slot(self, key):
+        self.client.decr(f'genta:running:{key}')
+
+class BoundedAdmissionQueue:
+    def __init__(self, max_active, max_waiting):
+        self.slots = threading.BoundedSemaphore(max_active)
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def enter(self, timeout):
+        # Returns None once the request has a slot, or why it didn't get one
+        if self.slots.acquire(blocking=False):
+            return None
+        with self.lock:
+            if self.waiting >= self.max_waiting:
+                return "queue_full"
+            self.waiting += 1
+        try:
+            with timedPhase('admission_wait'):
+                if self.slots.acquire(timeout=timeout):
+                    return None
+            return "queue_timeout"
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def leave(self):
+        self.slots.release()
+
+if ADMISSION_REDIS_URL:
+    if redis is None:
+        raise RuntimeError("ADMISSION_REDIS_URL is set but the redis package isn't installed (pip install redis)")
+    admission_backend = RedisAdmissionBackend(ADMISSION_REDIS_URL)
+else:
+    admission_backend = InProcessAdmissionBackend()
+admission_queue = BoundedAdmissionQueue(ADMISSION_MAX_ACTIVE, ADMISSION_MAX_QUEUE)
+admission_shed_counts = {} # (route, reason) -> requests turned away
+admission_shed_counts_lock = threading.Lock()
+
+def shedRequest(route_name, reason, status_code, retry_after, message):
+    with admission_shed_counts_lock:
+        admission_shed_counts[(route_name, reason)] = admission_shed_counts.get((route_name, reason), 0) + 1
+    response = jsonify({"error": message})
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999))) # whole seconds, rounded up
+    return response
+
+def admission_control(route_name):
+    """Decorator for write routes, goes under @token_required (it needs the user_info)."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(user_info, *args, **kwargs):
+            if not ADMISSION_CONTROL:
+                return f(user_info=user_info, *args, **kwargs)
+            user_key = user_info['user_id']
+            try:
+                retry_after = admission_backend.take_token(user_key, ADMISSION_USER_RATE, ADMISSION_USER_BURST)
+                got_user_slot = retry_after == 0 and admission_backend.acquire_slot(user_key, ADMISSION_USER_MAX_CONCURRENT)
+            except Exception as err:
+                # if the shared backend is down let requests through rather than failing every save
+                logEvent(logging.WARNING, "admission_backend_error", error=str(err))
+                return f(user_info=user_info, *args, **kwargs)
+            if retry_after > 0:
+                return shedRequest(route_name, "rate_limited", 429, retry_after, "Too many saves, slow down.")
+            if not got_user_slot:
+                return shedRequest(route_name, "user_concurrency", 429, 1, "Another save for this account is still running.")
+
+            try:
+                queue_result = admission_queue.enter(ADMISSION_QUEUE_TIMEOUT)
+                if queue_result is not None:
+                    return shedRequest(route_name, queue_result, 503, 1, "Server is busy, try again shortly.")
+                try:
+                    return f(user_info=user_info, *args, **kwargs)
+                finally:
+                    admission_queue.leave()
+            finally:
+                try:
+                    admission_backend.release_slot(user_key)
+                except Exception as err:
+                    logEvent(logging.WARNING, "admission_backend_error", error=str(err))
+        return decorated_function
+    return decorator
+
+
+
+
+#MARK: loadUserTreeFromDB
+@timedPhase('tree_load')
+def loadUserTreeFromDB(user_db_id):
+    # Loads every project, event and todo for a user in a fixed number of queries (3) no matter how big the tree is
+    # Before this genta did 1 query per project for events and 1 per event for todos which got really slow for big accounts
+    # The events and todos are filtered by joining back up to projects.userId so we never need a giant IN (...) list
+    projects_from_db = Project.query.filter_by(userId=user_db_id).order_by(Project.id).all()
+    events_from_db = Event.query.join(Project).filter(Project.userId == user_db_id).order_by(Event.id).all()
+    todos_from_db = Todo.query.join(Event).join(Project).filter(Project.userId == user_db_id).order_by(Todo.id).all()
+
+    # group the children by their parent id
+    events_by_project_id = {project.id: [] for project in projects_from_db}
+    for event in events_from_db:
+        events_by_project_id[event.projectId].append(event)
+    todos_by_event_id = {event.id: [] for event in events_from_db}
+    for todo in todos_from_db:
+        todos_by_event_id[todo.eventId].append(todo)
+
+    # attach the children to the relationships as if sqlalchemy had loaded them itself
+    # that way project.events and event.todos don't fire off a lazy load query each later on
+    # SQL Alchemy (n.d.) set_committed_value https://docs.sqlalchemy.org/en/20/orm/session_api.html#sqlalchemy.orm.attributes.set_committed_value
+    for project in projects_from_db:
+        set_committed_value(project, 'events', events_by_project_id[project.id])
+    for event in events_from_db:
+        set_committed_value(event, 'todos', todos_by_event_id[event.id])
+
+    return projects_from_db
+
 #MARK: getUserDataFromDB
-def getUserDataFromDB(user_google_id):
-    user_record = User.query.filter_by(googleId=user_google_id).first()
+@timedPhase('get_user_data')
+def getUserDataFromDB(user_google_id, user_record=None):
+    # the caller can pass in the user row if it already looked it up (saves doing the same query twice)
+    if user_record is None:
+        user_record = User.query.filter_by(googleId=user_google_id).first()
     # Like SELECT * FROM users WHERE googleID=user_google_id but SQL alchemy style 
     # and only grabs the first one (well there should only be one)
     user_db_id = None
     user_version_tag = None
 
     if user_record is None:
-        new_version_tag = str(uuid.uuid4()) # Create a new UUID for a ver tag
-        try:
-            new_user = User(googleId=user_google_id, versionTag=new_version_tag) # Create a new user
-            db.session.add(new_user)
-            db.session.commit()
-            user_db_id = new_user.id # set the variable as the actual new id now
-            user_version_tag = new_version_tag
-        except Exception as err:
-            print(f"Error creating new user: {err}")
-            db.session.rollback()
-            return None
-    else:
+        # creating a user is a write so it always goes to the primary db
+        switchToPrimaryDatabase()
+        # if the read came from a replica that's lagging behind the user might already exist on the primary
+        user_record = User.query.filter_by(googleId=user_google_id).first()
+        if user_record is None:
+            new_version_tag = str(uuid.uuid4()) # Create a new UUID for a ver tag
+            try:
+                new_user = User(googleId=user_google_id, versionTag=new_version_tag) # Create a new user
+                db.session.add(new_user)
+                db.session.commit()
+                user_db_id = new_user.id # set the variable as the actual new id now
+                user_version_tag = new_version_tag
+            except Exception as err:
+                logEvent(logging.ERROR, "create_user_failed", error=str(err))
+                db.session.rollback()
+                return None
+    if user_record is not None:
         user_db_id = user_record.id
         user_version_tag = user_record.versionTag
     
@@ -195,73 +1255,556 @@ def getUserDataFromDB(user_google_id):
         }
     
     # Time to get every project and the data nested within them
+    # loadUserTreeFromDB grabs the whole tree in 3 queries (instead of 1 per project + 1 per event)
+    return {
+        "user_db_id": user_db_id,
+        "user_version_tag": user_version_tag,
+        "projects": assembleProjectsData(loadUserTreeFromDB(user_db_id))
+    }
 
-    # Get all the projects that belong to that user
-    projects_from_db = Project.query.filter_by(userId=user_db_id).all()
+def assembleProjectsData(projects_from_db):
+    # Turns the loaded rows into the nested lists the frontend uses
     assembled_projects_data = []
 
-    # if there are any projects, for each proj get their events
-    if projects_from_db:
-        for current_project_from_db in projects_from_db:
-            project_dict = {
-                "id": current_project_from_db.id,
-                "projectTitle":current_project_from_db.projectTitle,
-                "dueDate":str(current_project_from_db.dueDate), # conv date to str
-                "events": [],
+    # one pass over the loaded rows, the events/todos are already attached so no more queries here
+    for current_project_from_db in projects_from_db:
+        project_dict = {
+            "id": current_project_from_db.id,
+            "projectTitle":current_project_from_db.projectTitle,
+            "dueDate":str(current_project_from_db.dueDate), # conv date to str
+            "events": [],
+        }
+
+        for current_event_from_db in current_project_from_db.events:
+            event_dict = {
+                "id": current_event_from_db.id,
+                "title": current_event_from_db.title,
+                "collapsed": current_event_from_db.collapsed,
+                "dueDate": str(current_event_from_db.dueDate), # conv Date object to string
+                "notes": current_event_from_db.notes,
+                "notesShown": current_event_from_db.notesShown,
+                "todoShown": current_event_from_db.todoShown,  
+                "todo": []
             }
 
-            # Get all events from db
-            events_from_db = Event.query.filter_by(projectId=current_project_from_db.id)
-            
-            if events_from_db:
-                for current_event_from_db in events_from_db:
-                    event_dict = {
-                        "id": current_event_from_db.id,
-                        "title": current_event_from_db.title,
-                        "collapsed": current_event_from_db.collapsed,
-                        "dueDate": str(current_event_from_db.dueDate), # conv Date object to string
-                        "notes": current_event_from_db.notes,
-                        "notesShown": current_event_from_db.notesShown,
-                        "todoShown": current_event_from_db.todoShown,  
-                        "todo": []
-                    }
-
-                    # get the todos
-                    todos_from_db = Todo.query.filter_by(eventId=current_event_from_db.id).all()
-                    if todos_from_db:
-                        for current_todo_from_db in todos_from_db:
-                            todo_dict = {
-                                "id": current_todo_from_db.id,
-                                "checked": current_todo_from_db.checked,
-                                "content": current_todo_from_db.content
-                            }
-                            event_dict["todo"].append(todo_dict)
-                    project_dict["events"].append(event_dict)
-            assembled_projects_data.append(project_dict)
+            for current_todo_from_db in current_event_from_db.todos:
+                todo_dict = {
+                    "id": current_todo_from_db.id,
+                    "checked": current_todo_from_db.checked,
+                    "content": current_todo_from_db.content
+                }
+                event_dict["todo"].append(todo_dict)
+            project_dict["events"].append(event_dict)
+        assembled_projects_data.append(project_dict)
+    return assembled_projects_data
+
+#MARK: streamUserDataFromDB
+# Streaming version of getUserDataFromDB for big accounts
+# Instead of building the whole nested dict and then jsonify-ing it (about 2x the account size in memory at once)
+# this reads the tree through a server side cursor and writes the JSON out in chunks as it goes,
+# so a request only ever holds one batch of rows + one chunk of output no matter how many notes/todos there are
+# The output is the same JSON as jsonify(getUserDataFromDB(...)) (same sorted keys, same order)
+# Flask (n.d.) Streaming Contents https://flask.palletsprojects.com/en/stable/patterns/streaming/
+# SQL Alchemy (n.d.) Fetching Large Result Sets with Yield Per https://docs.sqlalchemy.org/en/20/orm/queryguide/api.html#fetching-large-result-sets-with-yield-per
+GET_DATA_STREAM_BY_DEFAULT = os.getenv('GET_DATA_STREAM_BY_DEFAULT', 'false').lower() == 'true'
+STREAM_ROWS_PER_BATCH = int(os.getenv('STREAM_ROWS_PER_BATCH', '1000'))
+STREAM_CHUNK_BYTES = int(os.getenv('STREAM_CHUNK_BYTES', str(64 * 1024)))
+
+def encodeJSON(value):
+    return json.dumps(value, separators=(",", ":"))
+
+def streamUserDataFromDB(user_db_id, user_version_tag):
+    # One query for the whole tree, projects LEFT JOIN events LEFT JOIN todos sorted so that
+    # each project's rows come together and inside that each event's rows come together
+    # (can't use 3 separate cursors at once because mysql only allows one open result per connection)
+    tree_rows = db.session.execute(
+        db.select(
+            Project.id.label('project_id'), Project.projectTitle, Project.dueDate.label('project_due_date'),
+            Event.id.label('event_id'), Event.title, Event.collapsed, Event.dueDate.label('event_due_date'),
+            Event.notes, Event.notesShown, Event.todoShown,
+            Todo.id.label('todo_id'), Todo.checked, Todo.content
+        )
+        .outerjoin(Event, Event.projectId == Project.id)
+        .outerjoin(Todo, Todo.eventId == Event.id)
+        .where(Project.userId == user_db_id)
+        .order_by(Project.id, Event.id, Todo.id)
+        .execution_options(yield_per=STREAM_ROWS_PER_BATCH)
+    )
+
+    # keys are written in sorted order because that's what jsonify does
+    output_parts = []
+    output_size = 0
+    def write(part):
+        nonlocal output_size
+        output_parts.append(part)
+        output_size += len(part)
+
+    write('{"projects":[')
+    current_project_id = None
+    current_event_id = None
+
+    for row in tree_rows:
+        if row.project_id != current_project_id:
+            # close off the previous event + project
+            if current_event_id is not None:
+                write(f'],"todoShown":{encodeJSON(previous_row.todoShown)}}}')
+            if current_project_id is not None:
+                write(f'],"id":{encodeJSON(previous_row.project_id)},"projectTitle":{encodeJSON(previous_row.projectTitle)}}},')
+            write(f'{{"dueDate":{encodeJSON(str(row.project_due_date))},"events":[')
+            current_project_id = row.project_id
+            current_event_id = None
+
+        if row.event_id is not None and row.event_id != current_event_id:
+            if current_event_id is not None:
+                write(f'],"todoShown":{encodeJSON(previous_row.todoShown)}}},')
+            write(
+                f'{{"collapsed":{encodeJSON(row.collapsed)},"dueDate":{encodeJSON(str(row.event_due_date))},'
+                f'"id":{encodeJSON(row.event_id)},"notes":{encodeJSON(row.notes)},"notesShown":{encodeJSON(row.notesShown)},'
+                f'"title":{encodeJSON(row.title)},"todo":['
+            )
+            current_event_id = row.event_id
+            first_todo_in_event = True
+
+        if row.todo_id is not None:
+            if not first_todo_in_event:
+                write(',')
+            write(f'{{"checked":{encodeJSON(row.checked)},"content":{encodeJSON(row.content)},"id":{encodeJSON(row.todo_id)}}}')
+            first_todo_in_event = False
+
+        previous_row = row
+
+        # send what we have so far once it's big enough
+        if output_size >= STREAM_CHUNK_BYTES:
+            yield ''.join(output_parts)
+            output_parts.clear()
+            output_size = 0
+
+    # close whatever is still open
+    if current_event_id is not None:
+        write(f'],"todoShown":{encodeJSON(previous_row.todoShown)}}}')
+    if current_project_id is not None:
+        write(f'],"id":{encodeJSON(previous_row.project_id)},"projectTitle":{encodeJSON(previous_row.projectTitle)}}}')
+    write(f'],"user_db_id":{encodeJSON(user_db_id)},"user_version_tag":{encodeJSON(user_version_tag)}}}\n')
+    yield ''.join(output_parts)
+
+#MARK: getPartialUserDataFromDB
+# Smaller versions of /get-data for views that don't need the user's whole history
+# ?projectId=12          -> just that project's subtree
+# ?from=2025-06-01&to=.. -> only the events with a dueDate in that window (either end can be left out)
+# ?days=14               -> shortcut for from=today to=today+14 days (the dashboard's "upcoming" list)
+# ?fields=summary        -> leave out notes and todo (list views only show titles, dates and checkboxes)
+# They can be combined. Every query here starts from projects.userId and goes through
+# ix_projects_userId_dueDate / ix_events_projectId_dueDate (range scan on dueDate) / ix_todos_eventId
+GET_DATA_MAX_WINDOW_DAYS = int(os.getenv('GET_DATA_MAX_WINDOW_DAYS', '366'))
+
+def parseGetDataFilters(args):
+    # Returns None when the request is a normal full /get-data, otherwise the filters
+    # Raises ValueError with a message the client can read if something is malformed
+    filter_names = ('projectId', 'from', 'to', 'days', 'fields')
+    if not any(name in args for name in filter_names):
+        return None
+
+    filters = {"project_id": None, "due_from": None, "due_to": None, "include_details": True}
+    if 'projectId' in args:
+        try:
+            filters["project_id"] = int(args['projectId'])
+        except ValueError:
+            raise ValueError("projectId must be a number")
+
+    if 'days' in args:
+        if 'from' in args or 'to' in args:
+            raise ValueError("use either days or from/to, not both")
+        try:
+            days = int(args['days'])
+        except ValueError:
+            raise ValueError("days must be a number")
+        if days < 0 or days > GET_DATA_MAX_WINDOW_DAYS:
+            raise ValueError(f"days must be between 0 and {GET_DATA_MAX_WINDOW_DAYS}")
+        filters["due_from"] = date.today()
+        filters["due_to"] = filters["due_from"] + timedelta(days=days)
+    else:
+        try:
+            if 'from' in args:
+                filters["due_from"] = date.fromisoformat(args['from'])
+            if 'to' in args:
+                filters["due_to"] = date.fromisoformat(args['to'])
+        except ValueError:
+            raise ValueError("from/to must be dates like 2025-06-01")
+        if filters["due_from"] is not None and filters["due_to"] is not None and filters["due_from"] > filters["due_to"]:
+            raise ValueError("from must be before to")
+
+    fields = args.get('fields', 'full')
+    if fields not in ('full', 'summary'):
+        raise ValueError("fields must be full or summary")
+    filters["include_details"] = fields == 'full'
+    return filters
+
+@timedPhase('get_partial_user_data')
+def getPartialUserDataFromDB(user_db_id, user_version_tag, project_id=None, due_from=None, due_to=None, include_details=True):
+    windowed = due_from is not None or due_to is not None
+
+    def scopeToUser(query):
+        # same filters for the events and todos queries (both are joined up to projects)
+        query = query.filter(Project.userId == user_db_id)
+        if project_id is not None:
+            query = query.filter(Project.id == project_id)
+        if due_from is not None:
+            query = query.filter(Event.dueDate >= due_from)
+        if due_to is not None:
+            query = query.filter(Event.dueDate <= due_to)
+        return query
+
+    event_query = scopeToUser(Event.query.join(Project)).order_by(Event.id)
+    if not include_details:
+        event_query = event_query.options(defer(Event.notes)) # notes can be huge, don't even read them
+    events_from_db = event_query.all()
+
+    project_query = Project.query.filter_by(userId=user_db_id)
+    if project_id is not None:
+        project_query = project_query.filter(Project.id == project_id)
+    if windowed:
+        # with a date window only projects that have something in the window are sent
+        project_query = project_query.filter(Project.id.in_({event.projectId for event in events_from_db}))
+    projects_from_db = project_query.order_by(Project.id).all()
+
+    todos_by_event_id = {event.id: [] for event in events_from_db}
+    if include_details and events_from_db:
+        todos_from_db = scopeToUser(Todo.query.join(Event).join(Project)).order_by(Todo.id).all()
+        for todo in todos_from_db:
+            todos_by_event_id[todo.eventId].append(todo)
+
+    events_by_project_id = {project.id: [] for project in projects_from_db}
+    for event in events_from_db:
+        event_dict = {
+            "id": event.id,
+            "title": event.title,
+            "collapsed": event.collapsed,
+            "dueDate": str(event.dueDate),
+            "notesShown": event.notesShown,
+            "todoShown": event.todoShown,
+        }
+        if include_details:
+            event_dict["notes"] = event.notes
+            event_dict["todo"] = [
+                {"id": todo.id, "checked": todo.checked, "content": todo.content}
+                for todo in todos_by_event_id[event.id]
+            ]
+        events_by_project_id[event.projectId].append(event_dict)
+
     return {
         "user_db_id": user_db_id,
         "user_version_tag": user_version_tag,
-        "projects": assembled_projects_data
+        "projects": [
+            {
+                "id": project.id,
+                "projectTitle": project.projectTitle,
+                "dueDate": str(project.dueDate),
+                "events": events_by_project_id[project.id],
+            }
+            for project in projects_from_db
+        ]
     }
 
+#MARK: Snapshot cache
+# Caches the already encoded /get-data JSON for each user at a specific version tag
+# Lots of clients for the same user (phone, laptop, a bunch of tabs) ask for the exact same tree,
+# so the first one pays for the db + jsonify and the rest just get the bytes back
+# Each user only ever has one current version so the cache holds at most one snapshot per user
+SNAPSHOT_CACHE_MAX_BYTES = int(os.getenv('SNAPSHOT_CACHE_MAX_BYTES', str(64 * 1024 * 1024))) # 64MB by default
+
+class ResponseSnapshotCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # googleId -> (versionTag, encoded bytes, {content encoding: compressed bytes})
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.compressed_hits = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_google_id, version_tag):
+        with self.lock:
+            entry = self.entries.get(user_google_id)
+            if entry is None or entry[0] != version_tag:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(user_google_id)
+            self.hits += 1
+            return entry[1]
+
+    def getCompressed(self, user_google_id, version_tag, encoding):
+        # The same body already compressed with encoding, or None (doesn't count as a hit/miss, get() already did)
+        with self.lock:
+            entry = self.entries.get(user_google_id)
+            if entry is None or entry[0] != version_tag:
+                return None
+            compressed_body = entry[2].get(encoding)
+            if compressed_body is not None:
+                self.compressed_hits += 1
+            return compressed_body
+
+    def putCompressed(self, user_google_id, version_tag, encoding, compressed_body):
+        # Kept inside the uncompressed entry so it goes away with it (new version, invalidate, eviction)
+        with self.lock:
+            entry = self.entries.get(user_google_id)
+            if entry is None or entry[0] != version_tag or encoding in entry[2]:
+                return
+            entry[2][encoding] = compressed_body
+            self.current_bytes += len(compressed_body)
+            self._evictOverBudget()
+
+    def put(self, user_google_id, version_tag, encoded_body):
+        # too big to ever fit, don't bother (and don't evict everything else for it)
+        if len(encoded_body) > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(user_google_id)
+            self.entries[user_google_id] = (version_tag, encoded_body, {})
+            self.current_bytes += len(encoded_body)
+            self._evictOverBudget()
+
+    def _evictOverBudget(self):
+        # lock has to already be held when this runs
+        # evict the least recently used until we're back under the memory budget
+        while self.current_bytes > self.max_bytes:
+            oldest_google_id = next(iter(self.entries))
+            self._remove(oldest_google_id)
+            self.evictions += 1
+
+    def invalidate(self, user_google_id):
+        with self.lock:
+            self._remove(user_google_id)
+
+    def _remove(self, user_google_id):
+        # lock has to already be held when this runs
+        entry = self.entries.pop(user_google_id, None)
+        if entry is not None:
+            self.current_bytes -= len(entry[1]) + sum(len(compressed_body) for compressed_body in entry[2].values())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "compressed_hits": self.compressed_hits,
+            }
+
+snapshot_cache = ResponseSnapshotCache(SNAPSHOT_CACHE_MAX_BYTES)
+
+#MARK: Materialized snapshots
+# With MATERIALIZED_SNAPSHOTS=true the finished /get-data JSON for each user is also stored in the user_snapshots table
+# It gets rewritten in the same transaction as every save (so it can never be ahead of or behind the real tables),
+# and /get-data can then answer with one primary key read instead of rebuilding the document from 3 tables
+# The in memory snapshot cache above only helps on the worker that built it, this works across all of them and survives restarts
+# Backfill/rebuild:  flask --app app rebuild-snapshots
+# Check them:        flask --app app check-snapshots [--repair]
+MATERIALIZED_SNAPSHOTS = os.getenv('MATERIALIZED_SNAPSHOTS', 'false').lower() == 'true'
+
+def buildUserDocument(user_db_id, user_version_tag):
+    # The /get-data body for the user, read from the normalized tables
+    # (reads through the current session so unflushed/uncommitted changes in this transaction are included)
+    # Encoded with fixed settings (sorted keys, compact, trailing newline like the streamed body) instead of jsonify
+    # because jsonify pretty prints when app.debug is on, so the stored document would depend on how the app was started
+    return json.dumps({
+        "user_db_id": user_db_id,
+        "user_version_tag": user_version_tag,
+        "projects": assembleProjectsData(loadUserTreeFromDB(user_db_id))
+    }, sort_keys=True, separators=(",", ":")) + "\n"
+
+@timedPhase('snapshot_write')
+def writeMaterializedSnapshot(user_db_id, user_version_tag):
+    # Called before the commit of a save, the user row is already locked by claimNewVersionTag
+    # so two saves for the same user can't write the snapshot at the same time
+    db.session.flush()
+    document = buildUserDocument(user_db_id, user_version_tag)
+    snapshot = db.session.get(UserSnapshot, user_db_id)
+    if snapshot is None:
+        snapshot = UserSnapshot(userId=user_db_id)
+        db.session.add(snapshot)
+    snapshot.versionTag = user_version_tag
+    snapshot.document = document
+    snapshot.updatedAt = datetime.now(timezone.utc).replace(tzinfo=None)
+    return document
+
+def readMaterializedSnapshot(user_db_id, user_version_tag):
+    # Returns the stored document, or None if there isn't one for the user's current version
+    # (e.g. a user who hasn't saved since snapshots were turned on and the rebuild hasn't run)
+    snapshot = db.session.get(UserSnapshot, user_db_id)
+    if snapshot is None or snapshot.versionTag != user_version_tag:
+        return None
+    return snapshot.document
+
+def rebuildUserSnapshot(user_db_id):
+    # Locks the user row first so a save happening at the same time waits for us (or we wait for it)
+    user_record = db.session.execute(db.select(User).where(User.id == user_db_id).with_for_update()).scalar_one()
+    writeMaterializedSnapshot(user_db_id, user_record.versionTag)
+    db.session.commit()
+
+@app.cli.command('rebuild-snapshots')
+@click.option('--user', 'user_google_id', default=None, help='Only rebuild this user (Google sub).')
+@click.option('--missing-only', is_flag=True, help='Skip users whose snapshot is already at their current version.')
+def rebuildSnapshotsCommand(user_google_id, missing_only):
+    """Build (or rebuild) the materialized /get-data snapshot for every user."""
+    user_query = db.select(User.id, User.versionTag).order_by(User.id)
+    if user_google_id is not None:
+        user_query = user_query.where(User.googleId == user_google_id)
+    users = db.session.execute(user_query).all()
+    db.session.rollback()
+    rebuilt_count = 0
+    for user_db_id, user_version_tag in users:
+        if missing_only and readMaterializedSnapshot(user_db_id, user_version_tag) is not None:
+            db.session.rollback()
+            continue
+        rebuildUserSnapshot(user_db_id)
+        rebuilt_count += 1
+    click.echo(f"rebuilt {rebuilt_count} of {len(users)} snapshots")
+
+@app.cli.command('check-snapshots')
+@click.option('--repair', is_flag=True, help='Rebuild every snapshot that is missing, stale or wrong.')
+def checkSnapshotsCommand(repair):
+    """Compare every materialized snapshot with the normalized tables."""
+    user_ids = db.session.execute(db.select(User.id).order_by(User.id)).scalars().all()
+    problem_count = 0
+    db.session.rollback()
+    for user_db_id in user_ids:
+        # one transaction per user so the snapshot and the tables are read at the same point in time
+        user_record = db.session.get(User, user_db_id)
+        snapshot = db.session.get(UserSnapshot, user_db_id)
+        if snapshot is None:
+            problem = "missing"
+        elif snapshot.versionTag != user_record.versionTag:
+            problem = f"stale (snapshot at {snapshot.versionTag}, user at {user_record.versionTag})"
+        # compare the parsed JSON, not the text, so a document written with different whitespace/key order still counts as matching
+        elif json.loads(snapshot.document) != json.loads(buildUserDocument(user_db_id, user_record.versionTag)):
+            problem = "document does not match the tables"
+        else:
+            problem = None
+        db.session.rollback()
+        if problem is None:
+            continue
+        problem_count += 1
+        click.echo(f"user {user_db_id}: {problem}")
+        if repair:
+            rebuildUserSnapshot(user_db_id)
+    click.echo(f"{problem_count} of {len(user_ids)} snapshots had problems" + (" (repaired)" if repair and problem_count else ""))
+    if problem_count and not repair:
+        raise SystemExit(1)
+
+#MARK: claimNewVersionTag
+def claimNewVersionTag(user_db_id, client_version_tag):
+    # Compare-and-swap on the version tag: UPDATE users SET versionTag=new WHERE id=.. AND versionTag=client's tag
+    # If someone else saved first the tag won't match, nothing gets updated and this returns None (-> 409)
+    # Doing this as the FIRST write of the save also locks the user row until commit/rollback,
+    # so two saves for the same user can't both get past the check and run at the same time
+    # MySQL (n.d.) Locks Set by Different SQL Statements in InnoDB https://dev.mysql.com/doc/refman/8.0/en/innodb-locks-set.html
+    new_version_tag = str(uuid.uuid4())
+    result = db.session.execute(
+        db.update(User)
+        .where(User.id == user_db_id, User.versionTag == client_version_tag)
+        .values(versionTag=new_version_tag)
+    )
+    if result.rowcount != 1:
+        return None
+    return new_version_tag
+
+#MARK: insertNewRowsInBatches
+def insertNewRowsInBatches(user_db_id, existing_projects_list_from_db, new_projects, new_events, new_todos):
+    # Inserts every new row for a save a level at a time: all the projects, then all the events, then all the todos
+    # Each level is one executemany (the mysql driver turns that into a multi row INSERT) so a big paste or
+    # template import is a handful of statements instead of one INSERT + flush per row
+    # The ORM can't do this for us because neither MySQL nor SQLite can hand back the ids of a batch insert
+    # SQL Alchemy (n.d.) Executing Multiple Statements https://docs.sqlalchemy.org/en/20/tutorial/dbapi_transactions.html#sending-multiple-parameters
+
+    # Every row inserted below gets an autoincrement id bigger than anything the user already had,
+    # and ids go up in the same order as the rows in the batch, so reading back "this user's rows with id > old max"
+    # (sorted by id) lines up one to one with the lists. Two saves for the same user can't be inserting at the same time
+    # because claimNewVersionTag() holds the user row lock until commit (the count checks below are just a safety net)
+    old_max_project_id = max((project.id for project in existing_projects_list_from_db), default=0)
+    old_max_event_id = max((event.id for project in existing_projects_list_from_db for event in project.events), default=0)
+
+    # no_autoflush keeps the staged deletes from going out before the inserts, sqlite reuses the ids of deleted rows
+    # so if they went first a new row could get an id that isn't bigger than the old max
+    with db.session.no_autoflush:
+        insertNewRowLevels(user_db_id, old_max_project_id, old_max_event_id, new_projects, new_events, new_todos)
+
+def insertNewRowLevels(user_db_id, old_max_project_id, old_max_event_id, new_projects, new_events, new_todos):
+    new_project_ids = []
+    if new_projects:
+        db.session.execute(Project.__table__.insert(), new_projects)
+        new_project_ids = db.session.execute(
+            db.select(Project.id).where(Project.userId == user_db_id, Project.id > old_max_project_id).order_by(Project.id)
+        ).scalars().all()
+        if len(new_project_ids) != len(new_projects):
+            raise RuntimeError(f"expected {len(new_projects)} new project ids but got {len(new_project_ids)}")
+
+    new_event_ids = []
+    if new_events:
+        event_rows = []
+        for (parent_kind, parent_value), event_values in new_events:
+            project_id = parent_value if parent_kind == "db" else new_project_ids[parent_value]
+            event_rows.append({"projectId": project_id, **event_values})
+        db.session.execute(Event.__table__.insert(), event_rows)
+        new_event_ids = db.session.execute(
+            db.select(Event.id).join(Project).where(Project.userId == user_db_id, Event.id > old_max_event_id).order_by(Event.id)
+        ).scalars().all()
+        if len(new_event_ids) != len(new_events):
+            raise RuntimeError(f"expected {len(new_events)} new event ids but got {len(new_event_ids)}")
+
+    # todos are at the bottom of the tree so nothing needs their ids back
+    if new_todos:
+        todo_rows = []
+        for (parent_kind, parent_value), todo_values in new_todos:
+            event_id = parent_value if parent_kind == "db" else new_event_ids[parent_value]
+            todo_rows.append({"eventId": event_id, **todo_values})
+        db.session.execute(Todo.__table__.insert(), todo_rows)
+
 #MARK:editDatabase
-def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_from_db):
+@timedPhase('diff')
+def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_from_db, change_counts=None):
+    # NOTE: this stages + flushes everything but doesn't commit, the caller commits it together with the new version tag
+    # so the data and the version bump land in the same transaction (and rolls back if this doesn't return "SUCCESS")
+    # change_counts (optional dict) gets filled with how many rows were created/updated/deleted, for the save's log record
+    # existing_projects_list_from_db should come from loadUserTreeFromDB so every project.events and event.todos is already loaded
+    # Each level gets an id -> row dict so finding the matching row is a dict lookup instead of looping over every row
+    # (looping made a full save O(n^2) per level)
     processed_project_ids_from_client = set() #a set stores unique IDs and all project IDs should be unique
+    existing_projects_by_id = {project.id: project for project in existing_projects_list_from_db}
+
+    # New rows aren't added one by one anymore (that needed a flush per project/event just to learn its id)
+    # Instead they're collected here and inserted a whole level at a time at the end by insertNewRowsInBatches()
+    # A parent is either ("db", id) for a row that already exists or ("new", index into the list above it)
+    new_projects_to_insert = []
+    new_events_to_insert = [] # (parent project, column values)
+    new_todos_to_insert = [] # (parent event, column values)
+    if change_counts is None:
+        change_counts = {}
+    for row_type in ("projects", "events", "todos"):
+        for action in ("created", "updated", "deleted"):
+            change_counts[f"{row_type}_{action}"] = 0
 
     # Iterate through all projs to check if changes in project data
     for project_client_data in projects_from_client_list: 
         existing_project_in_db = None
         current_project_id_in_db = None
+        current_project_ref = None
 
         # if theres any projects inside the client data
         if project_client_data.get('id') != None:
             
             # find a project inside existing projects where id = id in project client data
-            existing_project_in_db = None
-            for project in existing_projects_list_from_db:
-                if project.id == project_client_data['id']:
-                    existing_project_in_db = project
-                    break
+            existing_project_in_db = existing_projects_by_id.get(project_client_data['id'])
 
             # this means that genta couldnt find a project where the id in db matches the cli id
             # which should never happen (maybe a bad actor is trying to do something)
@@ -269,6 +1812,7 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
                 return f"ERROR: Project with ID {project_client_data['id']} is not found in db for user"
             
             current_project_id_in_db = existing_project_in_db.id
+            current_project_ref = ("db", current_project_id_in_db)
 
             updated = False
             # If the project title has changed
@@ -289,6 +1833,7 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
                 updated = True
             if updated:
                 db.session.add(existing_project_in_db) # Mark for update by putting it into staging area
+                change_counts["projects_updated"] += 1
             
             # add the UNIQUE processed id to the set!
             processed_project_ids_from_client.add(current_project_id_in_db)
@@ -302,17 +1847,13 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
             else:
                 client_due_date_obj = project_client_data.get('dueDate')
 
-            # create a new project obj sqlalch
-            new_project = Project(
-                userId = user_db_id,
-                projectTitle = project_client_data['projectTitle'],
-                dueDate = client_due_date_obj
-            )
-            # add it to the db and get new id before commit for foreign keys
-            db.session.add(new_project) #stage
-            db.session.flush()
-            current_project_id_in_db = new_project.id
-            processed_project_ids_from_client.add(current_project_id_in_db) # add to list of processed ids
+            # queue up the new project, it gets its id when the batch is inserted
+            current_project_ref = ("new", len(new_projects_to_insert))
+            new_projects_to_insert.append({
+                "userId": user_db_id,
+                "projectTitle": project_client_data['projectTitle'],
+                "dueDate": client_due_date_obj
+            })
 
         # handle changing events
         # get the events
@@ -322,6 +1863,7 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
             existing_events_in_db_for_project = existing_project_in_db.events
         else:
             existing_events_in_db_for_project = []
+        existing_events_by_id = {event.id: event for event in existing_events_in_db_for_project}
         processed_event_ids_for_proj = set()
 
         # if there are any events
@@ -331,11 +1873,7 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
             # if the event has an ID, make ure to check if the id a matches an event on the db
             if event_client_data.get('id') != None:
                 
-                existing_event_in_db = None
-                for event in existing_events_in_db_for_project:
-                    if event.id == event_client_data['id']:
-                        existing_event_in_db = event
-                        break
+                existing_event_in_db = existing_events_by_id.get(event_client_data['id'])
             
                 # checks to see if there was any match
                 if existing_event_in_db == None:
@@ -343,6 +1881,7 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
                     return f"ERROR: event with ID {event_client_data['id']} is not found in table projects w id: {current_project_id_in_db}"
                 
                 current_event_id_in_db = existing_event_in_db.id
+                current_event_ref = ("db", current_event_id_in_db)
                 updated = False
 
                 # conv the date from str to date obj if its a str
@@ -374,6 +1913,7 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
                 if updated:
                     # put the updates in session (stage) ready for db commit 
                     db.session.add(existing_event_in_db)
+                    change_counts["events_updated"] += 1
                 
                 processed_event_ids_for_proj.add(current_event_id_in_db)
             else:
@@ -384,22 +1924,16 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
                 else:
                     client_event_due_date_obj = event_client_data['dueDate']
 
-                # create the new event in the database
-                new_event = Event(
-                    projectId=current_project_id_in_db,
-                    title=event_client_data['title'],
-                    collapsed=event_client_data['collapsed'],
-                    dueDate=client_event_due_date_obj,
-                    notes=event_client_data.get('notes'), # turns out i have to use .get() because the notes section can be null (stupid)
-                    todoShown=event_client_data['todoShown'],
-                    notesShown=event_client_data['notesShown']
-                )
-                # add changes to stage, get new id
-                db.session.add(new_event)
-                db.session.flush() 
-                # get id and log 
-                current_event_id_in_db = new_event.id
-                processed_event_ids_for_proj.add(current_event_id_in_db)
+                # queue up the new event under its project
+                current_event_ref = ("new", len(new_events_to_insert))
+                new_events_to_insert.append((current_project_ref, {
+                    "title": event_client_data['title'],
+                    "collapsed": event_client_data['collapsed'],
+                    "dueDate": client_event_due_date_obj,
+                    "notes": event_client_data.get('notes'), # turns out i have to use .get() because the notes section can be null (stupid)
+                    "todoShown": event_client_data['todoShown'],
+                    "notesShown": event_client_data['notesShown']
+                }))
 
             # time for the todos 
             # get todos from client otherwise use empty list
@@ -409,6 +1943,7 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
                 existing_todos_in_db_for_event = existing_event_in_db.todos
             else:
                 existing_todos_in_db_for_event = []
+            existing_todos_by_id = {todo.id: todo for todo in existing_todos_in_db_for_event}
 
             # set the id storage
             processed_todos_for_proj = set()
@@ -417,15 +1952,10 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
             for todo_client_data in todos_from_client:
                 existing_todo_in_db = None
 
-                print(f"todo client id = {todo_client_data.get('id')}")
                 #  if there are actually todos
                 if todo_client_data.get('id') != None:
                     # get todos that exist
-                    existing_todo_in_db = None
-                    for todo in existing_todos_in_db_for_event:
-                        if todo.id == todo_client_data['id']:
-                            existing_todo_in_db = todo
-                            break
+                    existing_todo_in_db = existing_todos_by_id.get(todo_client_data['id'])
                     # otherwise raise an err (should never happen)
                     if existing_todo_in_db == None:
                         return f"ERROR: todo with id {todo_client_data['id']} cannot be found"
@@ -442,72 +1972,781 @@ def editDatabase(user_db_id, projects_from_client_list, existing_projects_list_f
                     # if changes are present stage them for commit
                     if updated:
                         db.session.add(existing_todo_in_db)
+                        change_counts["todos_updated"] += 1
                     
                     processed_todos_for_proj.add(current_todo_id_in_db)
                 else:
                     # create a new todo cuz it aint exist bru :(
                     # note for future readers if this sucks im way too tired this logic hurts my brain
-                    new_todo = Todo(
-                        eventId=current_event_id_in_db,
-                        content=todo_client_data.get('content'),
-                        checked=todo_client_data['checked']
-                    )
-                    db.session.add(new_todo)
+                    new_todos_to_insert.append((current_event_ref, {
+                        "content": todo_client_data.get('content'),
+                        "checked": todo_client_data['checked']
+                    }))
             
             # del todos for event
             for existing_todo_item in existing_todos_in_db_for_event:
                 if existing_todo_item.id not in processed_todos_for_proj:
                     db.session.delete(existing_todo_item)
+                    change_counts["todos_deleted"] += 1
         
         # del events for proj 
         for existing_event_item in existing_events_in_db_for_project:
             if existing_event_item.id not in processed_event_ids_for_proj:
                 db.session.delete(existing_event_item)
+                # the cascade deletes its todos too
+                change_counts["events_deleted"] += 1
+                change_counts["todos_deleted"] += len(existing_event_item.todos)
 
     # Delete projects not in client data for user!
     for existing_project_item in existing_projects_list_from_db:
         if existing_project_item.id not in processed_project_ids_from_client:
             db.session.delete(existing_project_item)
+            change_counts["projects_deleted"] += 1
+            change_counts["events_deleted"] += len(existing_project_item.events)
+            change_counts["todos_deleted"] += sum(len(event.todos) for event in existing_project_item.events)
+
+    change_counts["projects_created"] = len(new_projects_to_insert)
+    change_counts["events_created"] = len(new_events_to_insert)
+    change_counts["todos_created"] = len(new_todos_to_insert)
 
-    # try to commit all staged changes
+    # try to insert the new rows and send all staged changes to the db
     try:
-        db.session.commit()
+        insertNewRowsInBatches(user_db_id, existing_projects_list_from_db, new_projects_to_insert, new_events_to_insert, new_todos_to_insert)
+        db.session.flush()
         return "SUCCESS"
     except Exception as err:
         db.session.rollback()
-        print(f"problem w database {err}")
+        logEvent(logging.ERROR, "edit_database_failed", user_db_id=user_db_id, error=str(err))
         return f"Database update failed: {err}"
 
 
 
 
+#MARK: applyPatchOperations
+# Instead of sending the whole tree to /update-data the client can send just what changed as a list of operations like
+# {"op": "update", "type": "todo", "id": 12, "fields": {"checked": true}}
+# {"op": "create", "type": "event", "parentId": 3, "tempId": "new-1", "fields": {"title": "...", "dueDate": "2025-05-01"}}
+# {"op": "create", "type": "todo", "parentTempId": "new-1", "fields": {"content": "..."}} (child of something created earlier in the same patch)
+# {"op": "delete", "type": "project", "id": 4}
+# Only the rows that are touched get loaded so the work scales with the size of the edit, not the account
+PATCH_MODELS = {"project": Project, "event": Event, "todo": Todo}
+PATCH_EDITABLE_FIELDS = {
+    "project": ("projectTitle", "dueDate"),
+    "event": ("title", "collapsed", "dueDate", "notes", "todoShown", "notesShown"),
+    "todo": ("checked", "content"),
+}
+PATCH_REQUIRED_CREATE_FIELDS = {
+    "project": ("projectTitle", "dueDate"),
+    "event": ("title", "dueDate"),
+    "todo": (),
+}
+PATCH_PARENT_TYPES = {"event": "project", "todo": "event"}
+
+def isPatchId(value):
+    # bool is a subclass of int in python but true/false is never a valid row id
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def checkPatchFieldValue(op_type, field_name, value):
+    # Returns what's wrong with the value, or None if it can go straight into the column
+    # (the rules come from the model's columns so they can't drift from the schema)
+    # Catching these here means a bad value is a 400 instead of the database rejecting the insert/update (500 with sql in it)
+    column = PATCH_MODELS[op_type].__table__.c[field_name]
+    if value is None:
+        return None if column.nullable else f"{field_name} can't be null"
+    if isinstance(column.type, db.Boolean):
+        if not isinstance(value, bool):
+            return f"{field_name} must be true or false"
+    elif isinstance(column.type, db.Date):
+        if not isinstance(value, str):
+            return f"{field_name} must be a date string (YYYY-MM-DD)"
+        try:
+            date.fromisoformat(value)
+        except ValueError:
+            return f"{field_name} must be a date string (YYYY-MM-DD)"
+    elif isinstance(column.type, db.String):
+        if not isinstance(value, str):
+            return f"{field_name} must be a string"
+        if column.type.length is not None and len(value) > column.type.length:
+            return f"{field_name} is longer than {column.type.length} characters"
+    return None
+
+def loadOwnedRowsForPatch(user_db_id, ids_by_type):
+    # At most 3 queries (one per table), every one of them joined back to projects.userId
+    # so a patch can never touch someone else's rows
+    owned_rows = {"project": {}, "event": {}, "todo": {}}
+    if ids_by_type["project"]:
+        for project in Project.query.filter(Project.userId == user_db_id, Project.id.in_(ids_by_type["project"])).all():
+            owned_rows["project"][project.id] = project
+    if ids_by_type["event"]:
+        for event in Event.query.join(Project).filter(Project.userId == user_db_id, Event.id.in_(ids_by_type["event"])).all():
+            owned_rows["event"][event.id] = event
+    if ids_by_type["todo"]:
+        for todo in Todo.query.join(Event).join(Project).filter(Project.userId == user_db_id, Todo.id.in_(ids_by_type["todo"])).all():
+            owned_rows["todo"][todo.id] = todo
+    return owned_rows
+
+def setPatchFields(row, fields):
+    # only sets the fields that actually changed (same idea as editDatabase)
+    for field_name, value in fields.items():
+        if field_name == "dueDate" and isinstance(value, str):
+            value = date.fromisoformat(value)
+        if getattr(row, field_name) != value:
+            setattr(row, field_name, value)
+
+def applyPatchOperations(user_db_id, operations):
+    # Stages every operation in the session but does NOT commit, the caller commits it together with the new version tag
+    # Returns ("SUCCESS", {tempId: newId}) or ("ERROR: ...", {})
+    if not isinstance(operations, list):
+        return "ERROR: operations must be a list", {}
+
+    # first pass: check every operation makes sense and collect the ids genta needs to load
+    # everything that could make the database reject the patch is caught here so it's a 400 and not a 500
+    ids_by_type = {"project": set(), "event": set(), "todo": set()}
+    seen_temp_ids = set() # tempIds are the keys of createdIds in the response so they have to be unique across all types
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            return f"ERROR: operation {index} is not an object", {}
+        op = operation.get('op')
+        op_type = operation.get('type')
+        fields = operation.get('fields', {})
+        if op not in ('create', 'update', 'delete'):
+            return f"ERROR: operation {index} has an unknown op {op}", {}
+        if op_type not in PATCH_MODELS:
+            return f"ERROR: operation {index} has an unknown type {op_type}", {}
+        if not isinstance(fields, dict):
+            return f"ERROR: operation {index} fields must be an object", {}
+        for field_name, value in fields.items():
+            if field_name not in PATCH_EDITABLE_FIELDS[op_type]:
+                return f"ERROR: operation {index} cannot set {field_name} on a {op_type}", {}
+            problem = checkPatchFieldValue(op_type, field_name, value)
+            if problem is not None:
+                return f"ERROR: operation {index} {problem}", {}
+
+        if op == 'create':
+            for field_name in PATCH_REQUIRED_CREATE_FIELDS[op_type]:
+                if fields.get(field_name) is None:
+                    return f"ERROR: operation {index} is missing {field_name} for the new {op_type}", {}
+            temp_id = operation.get('tempId')
+            if temp_id is not None:
+                if not isinstance(temp_id, (str, int)) or isinstance(temp_id, bool):
+                    return f"ERROR: operation {index} tempId must be a string or a number", {}
+                if str(temp_id) in seen_temp_ids:
+                    return f"ERROR: operation {index} reuses tempId {temp_id}", {}
+                seen_temp_ids.add(str(temp_id))
+            if op_type in PATCH_PARENT_TYPES:
+                if operation.get('parentId') is not None:
+                    if not isPatchId(operation['parentId']):
+                        return f"ERROR: operation {index} parentId must be an integer", {}
+                    ids_by_type[PATCH_PARENT_TYPES[op_type]].add(operation['parentId'])
+                elif operation.get('parentTempId') is None:
+                    return f"ERROR: operation {index} needs a parentId or parentTempId", {}
+                elif not isinstance(operation['parentTempId'], (str, int)) or isinstance(operation['parentTempId'], bool):
+                    return f"ERROR: operation {index} parentTempId must be a string or a number", {}
+        else:
+            if operation.get('id') is None:
+                return f"ERROR: operation {index} needs an id to {op}", {}
+            if not isPatchId(operation['id']):
+                return f"ERROR: operation {index} id must be an integer", {}
+            ids_by_type[op_type].add(operation['id'])
+
+    owned_rows = loadOwnedRowsForPatch(user_db_id, ids_by_type)
+    created_rows = {} # (type, str(tempId)) -> new row, str() so tempId 1 and parentTempId "1" are the same one (like the uniqueness check)
+
+    # second pass: actually apply them in order
+    try:
+        for index, operation in enumerate(operations):
+            op = operation['op']
+            op_type = operation['type']
+            fields = operation.get('fields', {})
+
+            if op == 'create':
+                new_row = PATCH_MODELS[op_type]()
+                if op_type == 'project':
+                    new_row.userId = user_db_id
+                else:
+                    parent_type = PATCH_PARENT_TYPES[op_type]
+                    if operation.get('parentId') is not None:
+                        parent_row = owned_rows[parent_type].get(operation['parentId'])
+                    else:
+                        parent_row = created_rows.get((parent_type, str(operation['parentTempId'])))
+                    if parent_row is None:
+                        return f"ERROR: parent {parent_type} for operation {index} is not found in db for user", {}
+                    # link through the relationship so sqlalchemy works out the foreign key when it inserts
+                    # (no flush needed to learn the parent's id)
+                    setattr(new_row, parent_type, parent_row)
+                setPatchFields(new_row, fields)
+                db.session.add(new_row)
+                if operation.get('tempId') is not None:
+                    created_rows[(op_type, str(operation['tempId']))] = new_row
+            else:
+                existing_row = owned_rows[op_type].get(operation['id'])
+                if existing_row is None:
+                    return f"ERROR: {op_type} with ID {operation['id']} is not found in db for user", {}
+                if op == 'update':
+                    setPatchFields(existing_row, fields)
+                else:
+                    # cascade takes care of the children
+                    db.session.delete(existing_row)
+                    del owned_rows[op_type][operation['id']]
+    except ValueError as err:
+        # bad date string etc
+        return f"ERROR: invalid value in operation {index}: {err}", {}
+
+    # one flush at the end so the new rows get their ids for the response
+    db.session.flush()
+    created_ids = {temp_id: row.id for (row_type, temp_id), row in created_rows.items()}
+    return "SUCCESS", created_ids
+
+
+
+
+#MARK: Search
+# Full text search over event titles/notes and todo contents, through the indexes from migration 3
+# Results from both tables are ranked together (MySQL relevance / SQLite bm25, higher is better) and
+# always joined back up to projects.userId so nobody can see anyone else's rows
+# MySQL (n.d.) Natural Language Full-Text Searches https://dev.mysql.com/doc/refman/8.0/en/fulltext-natural-language.html
+# SQLite (n.d.) FTS5 bm25() https://www.sqlite.org/fts5.html#the_bm25_function
+SEARCH_MAX_LIMIT = 100
+SEARCH_PREVIEW_CHARS = 200
+SEARCH_MAX_QUERY_CHARS = 200
+
+MYSQL_SEARCH_QUERY = sqlalchemy.text("""
+SELECT 'event' AS type, events.id AS id, projects.id AS projectId, events.id AS eventId, events.title AS eventTitle,
+       events.notes AS text, MATCH(events.title, events.notes) AGAINST (:query IN NATURAL LANGUAGE MODE) AS score
+FROM events JOIN projects ON projects.id = events.projectId
+WHERE projects.userId = :user_db_id AND MATCH(events.title, events.notes) AGAINST (:query IN NATURAL LANGUAGE MODE)
+UNION ALL
+SELECT 'todo' AS type, todos.id AS id, projects.id AS projectId, events.id AS eventId, events.title AS eventTitle,
+       todos.content AS text, MATCH(todos.content) AGAINST (:query IN NATURAL LANGUAGE MODE) AS score
+FROM todos JOIN events ON events.id = todos.eventId JOIN projects ON projects.id = events.projectId
+WHERE projects.userId = :user_db_id AND MATCH(todos.content) AGAINST (:query IN NATURAL LANGUAGE MODE)
+ORDER BY score DESC, type, id
+LIMIT :limit OFFSET :offset
+""")
+
+SQLITE_SEARCH_QUERY = sqlalchemy.text("""
+SELECT 'event' AS type, events.id AS id, projects.id AS projectId, events.id AS eventId, events.title AS eventTitle,
+       events.notes AS text, -bm25(events_fts) AS score
+FROM events_fts JOIN events ON events.id = events_fts.rowid JOIN projects ON projects.id = events.projectId
+WHERE events_fts MATCH :query AND projects.userId = :user_db_id
+UNION ALL
+SELECT 'todo' AS type, todos.id AS id, projects.id AS projectId, events.id AS eventId, events.title AS eventTitle,
+       todos.content AS text, -bm25(todos_fts) AS score
+FROM todos_fts JOIN todos ON todos.id = todos_fts.rowid JOIN events ON events.id = todos.eventId JOIN projects ON projects.id = events.projectId
+WHERE todos_fts MATCH :query AND projects.userId = :user_db_id
+ORDER BY score DESC, type, id
+LIMIT :limit OFFSET :offset
+""")
+
+# dialect name -> query, /search answers 501 on anything else
+SEARCH_QUERIES = {"mysql": MYSQL_SEARCH_QUERY, "sqlite": SQLITE_SEARCH_QUERY}
+
+def buildSQLiteMatchQuery(search_text):
+    # FTS5 has its own query syntax (AND, NEAR, quotes, column filters...) and throws errors on half typed input,
+    # so every word gets quoted and they're ORed together - that ranks like MySQL's natural language mode
+    words = re.findall(r'\w+', search_text)
+    return ' OR '.join(f'"{word}"' for word in words)
+
+@timedPhase('search')
+def searchUserData(user_db_id, search_text, limit, offset):
+    # Returns (results, has_more), the caller has to check the database is in SEARCH_QUERIES first
+    dialect_name = db.session.get_bind().dialect.name
+    search_query, query_value = SEARCH_QUERIES[dialect_name], search_text
+    if dialect_name == 'sqlite':
+        query_value = buildSQLiteMatchQuery(search_text)
+        if not query_value:
+            return [], False
+
+    # one extra row tells us if there's another page without a COUNT(*)
+    rows = db.session.execute(search_query, {"query": query_value, "user_db_id": user_db_id, "limit": limit + 1, "offset": offset}).all()
+    results = [{
+        "type": row.type,
+        "id": row.id,
+        "projectId": row.projectId,
+        "eventId": row.eventId,
+        "eventTitle": row.eventTitle,
+        "text": (row.text or '')[:SEARCH_PREVIEW_CHARS],
+        "score": float(row.score),
+    } for row in rows[:limit]]
+    return results, len(rows) > limit
+
+#MARK: Export / import
+# Offline backup, migration and seeding of accounts, one user per line of NDJSON in the same shape as /get-data
+# (plus googleId so the import knows whose tree it is)
+#   flask --app app export-data backup.ndjson [--user <google sub>]
+#   flask --app app import-data backup.ndjson [--chunk-size 5000] [--checkpoint import.ckpt]
+# The export reads everything through one server side cursor, and the import writes a chunk of users at a time
+# with executemany, so neither ever holds more than one batch + one user in memory
+# NDJSON (n.d.) Newline delimited JSON https://github.com/ndjson/ndjson-spec
+EXPORT_ROWS_PER_BATCH = int(os.getenv('EXPORT_ROWS_PER_BATCH', '5000'))
+
+def exportUserTrees(user_google_id=None, rows_per_batch=EXPORT_ROWS_PER_BATCH):
+    # Same idea as streamUserDataFromDB but for every user: users LEFT JOIN projects LEFT JOIN events LEFT JOIN todos
+    # in order, and a user's dict is handed out as soon as the rows move on to the next user
+    tree_query = (
+        db.select(
+            User.id.label('user_id'), User.googleId, User.versionTag,
+            Project.id.label('project_id'), Project.projectTitle, Project.dueDate.label('project_due_date'),
+            Event.id.label('event_id'), Event.title, Event.collapsed, Event.dueDate.label('event_due_date'),
+            Event.notes, Event.notesShown, Event.todoShown,
+            Todo.id.label('todo_id'), Todo.checked, Todo.content
+        )
+        .select_from(User)
+        .outerjoin(Project, Project.userId == User.id)
+        .outerjoin(Event, Event.projectId == Project.id)
+        .outerjoin(Todo, Todo.eventId == Event.id)
+        .order_by(User.id, Project.id, Event.id, Todo.id)
+        .execution_options(yield_per=rows_per_batch)
+    )
+    if user_google_id is not None:
+        tree_query = tree_query.where(User.googleId == user_google_id)
+
+    current_user = current_project = current_event = None
+    for row in db.session.execute(tree_query):
+        if current_user is None or row.user_id != current_user["user_db_id"]:
+            if current_user is not None:
+                yield current_user
+            current_user = {"googleId": row.googleId, "user_db_id": row.user_id, "user_version_tag": row.versionTag, "projects": []}
+            current_project = current_event = None
+        if row.project_id is not None and (current_project is None or row.project_id != current_project["id"]):
+            current_project = {"id": row.project_id, "projectTitle": row.projectTitle, "dueDate": str(row.project_due_date), "events": []}
+            current_user["projects"].append(current_project)
+            current_event = None
+        if row.event_id is not None and (current_event is None or row.event_id != current_event["id"]):
+            current_event = {
+                "id": row.event_id,
+                "title": row.title,
+                "collapsed": row.collapsed,
+                "dueDate": str(row.event_due_date),
+                "notes": row.notes,
+                "notesShown": row.notesShown,
+                "todoShown": row.todoShown,
+                "todo": []
+            }
+            current_project["events"].append(current_event)
+        if row.todo_id is not None:
+            current_event["todo"].append({"id": row.todo_id, "checked": row.checked, "content": row.content})
+    if current_user is not None:
+        yield current_user
+
+@app.cli.command('export-data')
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--user', 'user_google_id', default=None, help='Only export this user (Google sub).')
+@click.option('--batch-size', default=EXPORT_ROWS_PER_BATCH, show_default=True, help='Rows fetched from the cursor at a time.')
+def exportDataCommand(output, user_google_id, batch_size):
+    """Write every user's tree to OUTPUT as NDJSON (stdout by default)."""
+    exported_count = 0
+    for user_tree in exportUserTrees(user_google_id, batch_size):
+        output.write(encodeJSON(user_tree) + '\n')
+        exported_count += 1
+    click.echo(f"exported {exported_count} users", err=True)
+
+def readImportLine(line_number, line):
+    # Turns one NDJSON line into (googleId, version tag, project rows with their events/todos nested), checking the shape as it goes
+    try:
+        user_tree = json.loads(line)
+        projects = []
+        for project in user_tree.get("projects", []):
+            events = []
+            for event in project.get("events", []):
+                todos = [{"checked": bool(todo.get("checked", False)), "content": todo.get("content")} for todo in event.get("todo", [])]
+                events.append(({
+                    "title": event["title"],
+                    "collapsed": bool(event.get("collapsed", False)),
+                    "dueDate": date.fromisoformat(event["dueDate"]),
+                    "notes": event.get("notes"),
+                    "notesShown": bool(event.get("notesShown", True)),
+                    "todoShown": bool(event.get("todoShown", True)),
+                }, todos))
+            projects.append(({"projectTitle": project["projectTitle"], "dueDate": date.fromisoformat(project["dueDate"])}, events))
+        return str(user_tree["googleId"]), user_tree.get("user_version_tag") or str(uuid.uuid4()), projects
+    except (ValueError, KeyError, TypeError, AttributeError) as err:
+        raise click.ClickException(f"line {line_number} is not a valid user tree: {err!r}")
+
+def importUserChunk(user_trees):
+    # Inserts a chunk of whole users in one transaction: users, then projects, events and todos one executemany each
+    # The ids come back the same way as insertNewRowsInBatches: the users are brand new (and uncommitted) so every
+    # project/event under them is one we just inserted, and sorting by id gives the same order as the batch
+    # Returns (imported, skipped) - users that already exist are skipped so a rerun doesn't duplicate anyone
+    google_ids = [google_id for google_id, _, _ in user_trees]
+    existing_google_ids = set(db.session.execute(db.select(User.googleId).where(User.googleId.in_(google_ids))).scalars())
+    user_trees = [user_tree for user_tree in user_trees if user_tree[0] not in existing_google_ids]
+    if not user_trees:
+        return 0, len(existing_google_ids)
+
+    db.session.execute(User.__table__.insert(), [{"googleId": google_id, "versionTag": version_tag} for google_id, version_tag, _ in user_trees])
+    user_ids_by_google_id = dict(db.session.execute(
+        db.select(User.googleId, User.id).where(User.googleId.in_([google_id for google_id, _, _ in user_trees]))
+    ).all())
+    new_user_ids = list(user_ids_by_google_id.values())
+
+    project_rows = []
+    project_children = []
+    for google_id, _, projects in user_trees:
+        for project_values, events in projects:
+            project_rows.append({"userId": user_ids_by_google_id[google_id], **project_values})
+            project_children.append(events)
+    if not project_rows:
+        return len(user_trees), len(existing_google_ids)
+    db.session.execute(Project.__table__.insert(), project_rows)
+    new_project_ids = db.session.execute(
+        db.select(Project.id).where(Project.userId.in_(new_user_ids)).order_by(Project.id)
+    ).scalars().all()
+    if len(new_project_ids) != len(project_rows):
+        raise RuntimeError(f"expected {len(project_rows)} new project ids but got {len(new_project_ids)}")
+
+    event_rows = []
+    event_children = []
+    for project_id, events in zip(new_project_ids, project_children):
+        for event_values, todos in events:
+            event_rows.append({"projectId": project_id, **event_values})
+            event_children.append(todos)
+    if not event_rows:
+        return len(user_trees), len(existing_google_ids)
+    db.session.execute(Event.__table__.insert(), event_rows)
+    new_event_ids = db.session.execute(
+        db.select(Event.id).join(Project).where(Project.userId.in_(new_user_ids)).order_by(Event.id)
+    ).scalars().all()
+    if len(new_event_ids) != len(event_rows):
+        raise RuntimeError(f"expected {len(event_rows)} new event ids but got {len(new_event_ids)}")
+
+    todo_rows = [{"eventId": event_id, **todo_values} for event_id, todos in zip(new_event_ids, event_children) for todo_values in todos]
+    if todo_rows:
+        db.session.execute(Todo.__table__.insert(), todo_rows)
+    return len(user_trees), len(existing_google_ids)
+
+def writeImportCheckpoint(checkpoint_path, input_name, line_number):
+    # write to a temp file and swap it in so a crash mid write can't leave a broken checkpoint
+    temporary_path = checkpoint_path + '.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump({"input": input_name, "line": line_number}, checkpoint_file)
+    os.replace(temporary_path, checkpoint_path)
+
+@app.cli.command('import-data')
+@click.argument('input_file', metavar='INPUT', type=click.File('r'), default='-')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows (users + projects + events + todos) inserted per transaction.')
+@click.option('--checkpoint', 'checkpoint_path', default=None, help='File that records the last committed line, so a stopped import can carry on from there.')
+def importDataCommand(input_file, chunk_size, checkpoint_path):
+    """Load users from an NDJSON export. Users that already exist are skipped."""
+    resume_after_line = 0
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get("input") != input_file.name:
+            raise click.ClickException(f"checkpoint {checkpoint_path} is for {checkpoint.get('input')}, not {input_file.name}")
+        resume_after_line = checkpoint["line"]
+        click.echo(f"resuming after line {resume_after_line}", err=True)
+
+    imported_count = skipped_count = 0
+    chunk = []
+    chunk_rows = 0
+
+    def commitChunk(line_number):
+        nonlocal imported_count, skipped_count, chunk, chunk_rows
+        try:
+            imported, skipped = importUserChunk(chunk)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        imported_count += imported
+        skipped_count += skipped
+        if checkpoint_path is not None:
+            writeImportCheckpoint(checkpoint_path, input_file.name, line_number)
+        click.echo(f"line {line_number}: {imported_count} users imported, {skipped_count} skipped", err=True)
+        chunk = []
+        chunk_rows = 0
+
+    line_number = 0
+    for line_number, line in enumerate(input_file, start=1):
+        if line_number <= resume_after_line or not line.strip():
+            continue
+        user_tree = readImportLine(line_number, line)
+        chunk.append(user_tree)
+        chunk_rows += 1 + sum(1 + len(events) + sum(len(todos) for _, todos in events) for _, events in user_tree[2])
+        if chunk_rows >= chunk_size:
+            commitChunk(line_number)
+    if chunk:
+        commitChunk(line_number)
+    click.echo(f"done: {imported_count} users imported, {skipped_count} skipped", err=True)
+    if MATERIALIZED_SNAPSHOTS and imported_count:
+        click.echo("materialized snapshots are on, run `flask rebuild-snapshots --missing-only` for the imported users", err=True)
+
+#MARK: Change notifications
+# Lets other devices hear about a save straight away instead of polling /get-data (or finding out from a 409)
+# Every committed save publishes {"user_version_tag": ..., "source": ...} (plus the operations for /patch-data)
+# to everyone subscribed for that user, through /changes as Server-Sent Events or a long poll
+# change_broker can be swapped for anything with the same subscribe()/publish() methods, e.g. one backed by
+# redis pub/sub so saves on one worker process reach clients connected to another (the built in one is per process)
+# Idle connections don't hold a db connection, and waiting is just a threading.Event, so when running under
+# gevent (gunicorn -k gevent) each one is a greenlet instead of a whole thread
+# MDN (n.d.) Using server-sent events https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events/Using_server-sent_events
+CHANGES_HEARTBEAT_SECONDS = float(os.getenv('CHANGES_HEARTBEAT_SECONDS', '15')) # keeps proxies from closing idle streams
+CHANGES_MAX_STREAM_SECONDS = float(os.getenv('CHANGES_MAX_STREAM_SECONDS', '300')) # then the client reconnects, spreads out load
+CHANGES_LONG_POLL_SECONDS = float(os.getenv('CHANGES_LONG_POLL_SECONDS', '25'))
+CHANGES_RETRY_MS = int(os.getenv('CHANGES_RETRY_MS', '3000'))
+CHANGES_QUEUE_SIZE = 100 # per connection, a client that far behind only needs the latest version anyway
+
+class ChangeSubscription:
+    def __init__(self, broker, user_google_id):
+        self.broker = broker
+        self.user_google_id = user_google_id
+        self.messages = deque(maxlen=CHANGES_QUEUE_SIZE)
+        self.ready = threading.Event()
+
+    def deliver(self, message):
+        self.messages.append(message)
+        self.ready.set()
+
+    def wait(self, timeout):
+        # Returns the messages that came in (an empty list if the timeout ran out first)
+        self.ready.wait(timeout)
+        self.ready.clear()
+        messages = []
+        while self.messages:
+            messages.append(self.messages.popleft())
+        return messages
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class InProcessChangeBroker:
+    def __init__(self):
+        self.subscriptions = {} # user google id -> set of ChangeSubscription
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_google_id):
+        subscription = ChangeSubscription(self, user_google_id)
+        with self.lock:
+            self.subscriptions.setdefault(user_google_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            user_subscriptions = self.subscriptions.get(subscription.user_google_id)
+            if user_subscriptions is not None:
+                user_subscriptions.discard(subscription)
+                if not user_subscriptions:
+                    del self.subscriptions[subscription.user_google_id]
+
+    def publish(self, user_google_id, message):
+        with self.lock:
+            user_subscriptions = list(self.subscriptions.get(user_google_id, ()))
+        for subscription in user_subscriptions:
+            subscription.deliver(message)
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(user_subscriptions) for user_subscriptions in self.subscriptions.values())
+
+change_broker = InProcessChangeBroker()
+
+def publishChange(user_google_id, user_version_tag, source, operations=None, created_ids=None):
+    # Only call this after the commit, otherwise clients could fetch before the change is visible
+    message = {"user_version_tag": user_version_tag, "source": source}
+    if operations is not None:
+        message["operations"] = operations
+        message["createdIds"] = created_ids
+    try:
+        change_broker.publish(user_google_id, message)
+    except Exception as err:
+        # the save already went through, a broker problem shouldn't turn it into an error for the client
+        logEvent(logging.WARNING, "publish_change_failed", error=str(err))
+
+def addTreeToChange(user_google_id, message):
+    # For ?include=tree, sends the whole new tree with the change so the client doesn't need a /get-data
+    cached_body = snapshot_cache.get(user_google_id, message["user_version_tag"])
+    if cached_body is not None:
+        tree = json.loads(cached_body)
+    else:
+        tree = getUserDataFromDB(user_google_id)
+    db.session.close() # give the connection back while we sit idle again
+    return {**message, "user_version_tag": tree["user_version_tag"], "tree": tree}
+
+def formatChangeEvent(message):
+    return f"id: {message['user_version_tag']}\nevent: change\ndata: {encodeJSON(message)}\n\n"
+
+def streamChanges(subscription, current_version_tag, last_seen_version_tag, include_tree):
+    try:
+        yield f"retry: {CHANGES_RETRY_MS}\n\n"
+        # anything saved while the client wasn't connected
+        if last_seen_version_tag != current_version_tag:
+            message = {"user_version_tag": current_version_tag, "source": "connect"}
+            yield formatChangeEvent(addTreeToChange(subscription.user_google_id, message) if include_tree else message)
+
+        stream_deadline = time.monotonic() + CHANGES_MAX_STREAM_SECONDS
+        while time.monotonic() < stream_deadline:
+            messages = subscription.wait(min(CHANGES_HEARTBEAT_SECONDS, max(stream_deadline - time.monotonic(), 0)))
+            if not messages:
+                # comment line, EventSource ignores it. Also how we find out the client went away
+                yield ": keep-alive\n\n"
+                continue
+            if include_tree:
+                # only the newest tree matters if a few saves came in at once
+                yield formatChangeEvent(addTreeToChange(subscription.user_google_id, messages[-1]))
+            else:
+                for message in messages:
+                    yield formatChangeEvent(message)
+    finally:
+        # runs when the client disconnects too (the server closes the generator)
+        subscription.close()
+
 #MARK: /verify-login
 @app.route('/verify-login', methods=['GET']) 
+@useReadReplica
 @token_required
 def verify_login(user_info):
     # If this point is reached, token_required has passed and user is signed in
     return jsonify({"message": "Successfully signed in with Google."}), 200
 
+#MARK: /session-token
+@app.route('/session-token', methods=['POST'])
+@token_required
+def session_token(user_info):
+    # Swap a Google ID token for a short lived session token (see Session tokens)
+    if not SESSION_TOKEN_KEYS:
+        return jsonify({"error": "Session tokens are not enabled on this server."}), 501
+    if user_info.get('token_type') == 'session':
+        # otherwise a session token could be refreshed forever without Google ever seeing the user again
+        return jsonify({"error": "A Google ID token is needed to get a session token."}), 401
+    try:
+        user_db_id = lookupUserDbId(user_info)
+        if user_db_id is None:
+            # first time we've seen this user, getUserDataFromDB creates them (their tree is empty so it's cheap)
+            user_db_id = getUserDataFromDB(user_info['user_id'])["user_db_id"]
+            if user_db_id is None:
+                return jsonify({"error": "Could not create user."}), 500
+        return jsonify({
+            "session_token": issueSessionToken(user_info['user_id'], user_db_id),
+            "token_type": "Bearer",
+            "expires_in": SESSION_TOKEN_TTL_SECONDS
+        }), 200
+    except Exception as err:
+        db.session.rollback()
+        logEvent(logging.ERROR, "session_token_failed", error=str(err), exc_info=err)
+        return jsonify({"error": f"Error processing request: {err}"}), 500
+
 #MARK: /get-data
+def makeGetDataResponse(response, version_tag):
+    # Attach the ETag and tell browsers to always check back with us before reusing their copy
+    # (weak if the body is compressed, same reason as in compressResponse)
+    if version_tag is not None:
+        response.set_etag(version_tag, weak='Content-Encoding' in response.headers)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def makeCachedBodyResponse(user_google_id, version_tag, body):
+    # A full /get-data body that's in snapshot_cache, compressed the way the client asked
+    # The compressed copy is kept next to the raw bytes so each version gets compressed once per encoding,
+    # otherwise compressResponse would redo it on every cache hit (~27ms of gzip for a 1.5MB account vs ~2ms for the hit)
+    response = app.response_class(body, mimetype='application/json')
+    encoding = pickResponseEncoding(len(body))
+    if encoding is not None:
+        compressed_body = snapshot_cache.getCompressed(user_google_id, version_tag, encoding)
+        if compressed_body is None:
+            compressed_body = compressBody(body, encoding)
+            snapshot_cache.putCompressed(user_google_id, version_tag, encoding, compressed_body)
+        else:
+            recordCompression(len(body), len(compressed_body))
+        response.set_data(compressed_body)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return makeGetDataResponse(response, version_tag)
+
+def getDataETag(version_tag, partial_filters):
+    # Normally the ETag is just the version tag, but a date window can change without a save
+    # (?days=N is counted from today, so the same URL covers different dates tomorrow)
+    # so for windows the resolved dates are part of the ETag too and a new day means a new ETag
+    if version_tag is None or partial_filters is None:
+        return version_tag
+    if partial_filters["due_from"] is None and partial_filters["due_to"] is None:
+        return version_tag
+    return f"{version_tag}:{partial_filters['due_from']}:{partial_filters['due_to']}"
+
 @app.route('/get-data', methods=['GET'])
+@useReadReplica
 @token_required
 def get_data(user_info):
     # Get the user ID to retrieve the data for that user from the database
     user_id = user_info['user_id']
-    print(user_info)
+    logEvent(logging.DEBUG, "get_data", user_id=user_id)
     try:
-        return jsonify(getUserDataFromDB(user_id))
+        try:
+            partial_filters = parseGetDataFilters(request.args)
+        except ValueError as err:
+            return jsonify({"error": str(err)}), 400
+
+        # The version tag changes every time /update-data saves something, so it works as an ETag
+        # If the client already has the latest version genta can answer 304 straight away
+        # after just looking up the user (no projects/events/todos queries at all)
+        # MDN (n.d.) If-None-Match https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/If-None-Match
+        user_record = lookupUserRecord(user_info)
+        if user_record is not None:
+            etag = getDataETag(user_record.versionTag, partial_filters)
+            if request.if_none_match.contains_weak(etag):
+                return makeGetDataResponse(make_response('', 304), etag)
+
+        # Partial fetches (a single project, a date window, no notes/todos) aren't cached, they're cheap anyway
+        # The ETag is the version tag (plus the window's dates, see getDataETag), browsers keep ETags per URL so each filter combo gets its own
+        if partial_filters is not None:
+            if user_record is None:
+                # new user, let getUserDataFromDB create them (they have nothing to filter yet)
+                user_data = getUserDataFromDB(user_id)
+                user_record = User.query.filter_by(googleId=user_id).first()
+                if user_record is None:
+                    return jsonify(user_data)
+            if partial_filters["project_id"] is not None and Project.query.filter_by(id=partial_filters["project_id"], userId=user_record.id).first() is None:
+                return jsonify({"error": "project not found"}), 404
+            user_data = getPartialUserDataFromDB(user_record.id, user_record.versionTag, **partial_filters)
+            return makeGetDataResponse(jsonify(user_data), getDataETag(user_record.versionTag, partial_filters))
+
+        # If some other client already fetched this exact version just send the same bytes back
+        if user_record is not None:
+            cached_body = snapshot_cache.get(user_id, user_record.versionTag)
+            if cached_body is not None:
+                return makeCachedBodyResponse(user_id, user_record.versionTag, cached_body)
+
+        # Streaming mode (?stream=1, or on for everyone with GET_DATA_STREAM_BY_DEFAULT) keeps memory flat for huge accounts
+        # brand new users still go the normal way because getUserDataFromDB is what creates them
+        stream_requested = request.args.get('stream', str(GET_DATA_STREAM_BY_DEFAULT)).lower() in ('1', 'true')
+        if stream_requested and user_record is not None:
+            response = app.response_class(
+                stream_with_context(streamUserDataFromDB(user_record.id, user_record.versionTag)),
+                mimetype='application/json'
+            )
+            return makeGetDataResponse(response, user_record.versionTag)
+
+        # One primary key read for the stored document
+        if MATERIALIZED_SNAPSHOTS and user_record is not None:
+            with timedPhase('snapshot_read'):
+                document = readMaterializedSnapshot(user_record.id, user_record.versionTag)
+            if document is not None:
+                document_body = document.encode()
+                snapshot_cache.put(user_id, user_record.versionTag, document_body)
+                return makeCachedBodyResponse(user_id, user_record.versionTag, document_body)
+
+        user_data = getUserDataFromDB(user_id, user_record)
+        response = jsonify(user_data)
+        if user_data["user_version_tag"] is not None:
+            snapshot_cache.put(user_id, user_data["user_version_tag"], response.get_data())
+            return makeCachedBodyResponse(user_id, user_data["user_version_tag"], response.get_data())
+        return makeGetDataResponse(response, user_data["user_version_tag"])
     except Exception as err:
-        return jsonify({"error": err}), 500 
+        db.session.rollback()
+        logEvent(logging.ERROR, "get_data_failed", error=str(err), exc_info=err)
+        return jsonify({"error": f"Error processing request: {err}"}), 500
 
 #MARK: /update-data
 @app.route('/update-data', methods=['POST'])
 @token_required
+@admission_control('update-data')
 def update_data(user_info):
-    print(user_info)
+    logEvent(logging.DEBUG, "update_data", user_id=user_info['user_id'])
     try:
-        # Get the data from the POST request payload
-        data_from_request = request.get_json()
+        # Get the data from the POST request payload (can be gzipped)
+        data_from_request, request_error = readRequestJSON()
+        if request_error is not None:
+            return jsonify({"error": request_error[0]}), request_error[1]
         if not data_from_request:
             return jsonify({"error": "Invalid JSON data provided"}), 400
         
@@ -518,49 +2757,214 @@ def update_data(user_info):
         # get the user's ID from JWT auth
         user_id = user_info['user_id']
 
-        user_on_db = User.query.filter_by(googleId=user_id).all()
-
-        if not user_on_db:
+        # Just the user id (one indexed lookup, or none with a session token), not the whole tree
+        user_db_id = lookupUserDbId(user_info)
+        if user_db_id is None:
             return jsonify({"error":"User does not exist on the database. Run /get-data endpoint to create a user."}), 404
 
-        # Get info from the database to feed into editDatabase() func
-        current_data_from_db = getUserDataFromDB(user_id)
-        user_db_id = current_data_from_db["user_db_id"]
-        current_db_version_tag = current_data_from_db["user_version_tag"]
-        existing_projects_from_db = Project.query.filter_by(userId=user_db_id).all()
-
-        # if there isnt a user ID (shouldnt happen)
-        if user_db_id is None:
-            return jsonify({"error": "User does not exist and could not be created."}), 400
-        # if the version tag for the client is outdated, the client needs to refresh and update to get the latest changes
-        if current_db_version_tag != client_version_tag:
-            print(f"Current db version tag: {current_db_version_tag}")
-            print(f"Client version tag: {client_version_tag}")
+        # Everything from here to the commit is one transaction
+        # Swap the version tag first, if the client's tag is outdated the client needs to refresh and update to get the latest changes
+        new_app_version_tag = claimNewVersionTag(user_db_id, client_version_tag)
+        if new_app_version_tag is None:
+            db.session.rollback()
+            logEvent(logging.INFO, "save_conflict", user_db_id=user_db_id, client_version_tag=client_version_tag)
             return jsonify({"error": "Client data is outdated. Please refresh to get the latest data."}), 409 # HTTP 409 is a conflict err
 
+        # bulk load the tree (3 queries) so editDatabase doesn't lazy load every project's events and every event's todos
+        existing_projects_from_db = loadUserTreeFromDB(user_db_id)
+
         # edit the database using the editDatabase() func
-        edit_result = editDatabase(user_db_id, projects_to_update_from_client, existing_projects_from_db)
+        change_counts = {}
+        edit_result = editDatabase(user_db_id, projects_to_update_from_client, existing_projects_from_db, change_counts)
 
         # check if the edit ran successfully
-        if "ERROR" in edit_result:
-            return jsonify({"error": edit_result}), 400 # Or 500 if a server-side error
-        else:
-            # Successful edit!!
-            # generate new version tag and commit the changes to the database
-            new_app_version_tag = str(uuid.uuid4())
-            user_record = User.query.get(user_db_id)
-            user_record.versionTag = new_app_version_tag
-            db.session.commit() 
-
-            return jsonify({
-                "message": "Data updated successfully.",
-                "newVersionTag": new_app_version_tag
-            }), 200
+        if edit_result != "SUCCESS":
+            db.session.rollback()
+            if "ERROR" in edit_result:
+                return jsonify({"error": edit_result}), 400
+            return jsonify({"error": edit_result}), 500
+
+        # Successful edit!!
+        # rewrite the materialized snapshot inside the same transaction
+        new_document = writeMaterializedSnapshot(user_db_id, new_app_version_tag) if MATERIALIZED_SNAPSHOTS else None
+
+        # commit the changes and the new version tag to the database together
+        with timedPhase('commit'):
+            db.session.commit()
+        # the old snapshot is useless now so free up the memory (or swap in the new one straight away)
+        snapshot_cache.invalidate(user_id)
+        if new_document is not None:
+            snapshot_cache.put(user_id, new_app_version_tag, new_document.encode())
+        # one record per save instead of a line per todo
+        logEvent(logging.INFO, "save", route="update-data", user_db_id=user_db_id, version_tag=new_app_version_tag, **change_counts)
+        # tell the user's other devices
+        publishChange(user_id, new_app_version_tag, 'update-data')
+
+        return jsonify({
+            "message": "Data updated successfully.",
+            "newVersionTag": new_app_version_tag
+        }), 200
+    except Exception as err:
+        db.session.rollback()
+        logEvent(logging.ERROR, "update_data_failed", error=str(err), exc_info=err)
+        return jsonify({"error": f"Error processing request: {err}"}), 500
+
+
+#MARK: /patch-data
+@app.route('/patch-data', methods=['POST'])
+@token_required
+@admission_control('patch-data')
+def patch_data(user_info):
+    logEvent(logging.DEBUG, "patch_data", user_id=user_info['user_id'])
+    try:
+        data_from_request, request_error = readRequestJSON()
+        if request_error is not None:
+            return jsonify({"error": request_error[0]}), request_error[1]
+        if not data_from_request:
+            return jsonify({"error": "Invalid JSON data provided"}), 400
+
+        client_version_tag = data_from_request.get('user_version_tag')
+        operations_from_client = data_from_request.get('operations', [])
+        user_id = user_info['user_id']
+
+        user_db_id = lookupUserDbId(user_info)
+        if user_db_id is None:
+            return jsonify({"error":"User does not exist on the database. Run /get-data endpoint to create a user."}), 404
+        # same version check as /update-data
+        new_app_version_tag = claimNewVersionTag(user_db_id, client_version_tag)
+        if new_app_version_tag is None:
+            db.session.rollback()
+            return jsonify({"error": "Client data is outdated. Please refresh to get the latest data."}), 409
+
+        patch_result, created_ids = applyPatchOperations(user_db_id, operations_from_client)
+        if "ERROR" in patch_result:
+            db.session.rollback()
+            return jsonify({"error": patch_result}), 400
+
+        new_document = writeMaterializedSnapshot(user_db_id, new_app_version_tag) if MATERIALIZED_SNAPSHOTS else None
+
+        # the changes, the new version tag and the snapshot go into the db in one commit
+        with timedPhase('commit'):
+            db.session.commit()
+        snapshot_cache.invalidate(user_id)
+        if new_document is not None:
+            snapshot_cache.put(user_id, new_app_version_tag, new_document.encode())
+        operation_counts = {}
+        for operation in operations_from_client:
+            count_name = f"{operation['type']}s_{operation['op']}d" # e.g. todos_created, events_deleted
+            operation_counts[count_name] = operation_counts.get(count_name, 0) + 1
+        logEvent(logging.INFO, "save", route="patch-data", user_db_id=user_db_id, version_tag=new_app_version_tag, **operation_counts)
+        # the other devices can just apply the same operations instead of refetching
+        publishChange(user_id, new_app_version_tag, 'patch-data', operations_from_client, created_ids)
+
+        return jsonify({
+            "message": "Data updated successfully.",
+            "newVersionTag": new_app_version_tag,
+            "createdIds": created_ids
+        }), 200
+    except Exception as err:
+        db.session.rollback()
+        logEvent(logging.ERROR, "patch_data_failed", error=str(err), exc_info=err)
+        return jsonify({"error": f"Error processing request: {err}"}), 500
+
+
+#MARK: /changes
+@app.route('/changes', methods=['GET'])
+@token_required
+def changes(user_info):
+    # Server-Sent Events by default, or a long poll with ?mode=poll&since=<version tag>
+    # (EventSource can't send an Authorization header, so browsers read the stream with fetch() instead)
+    # ?include=tree sends the full new tree with every change
+    user_id = user_info['user_id']
+    include_tree = request.args.get('include') == 'tree'
+    # subscribe before reading the current version so a save in between can't be missed
+    subscription = change_broker.subscribe(user_id)
+    try:
+        user_record = lookupUserRecord(user_info)
+        if user_record is None:
+            subscription.close()
+            return jsonify({"error":"User does not exist on the database. Run /get-data endpoint to create a user."}), 404
+        current_version_tag = user_record.versionTag
+        # idle connections must not hold on to a db connection from the pool
+        db.session.close()
+
+        if request.args.get('mode') == 'poll':
+            try:
+                since_version_tag = request.args.get('since')
+                if since_version_tag != current_version_tag:
+                    messages = [{"user_version_tag": current_version_tag, "source": "connect"}]
+                else:
+                    messages = subscription.wait(CHANGES_LONG_POLL_SECONDS)
+            finally:
+                subscription.close()
+            if not messages:
+                return make_response('', 204) # nothing changed, poll again
+            if include_tree:
+                messages = [addTreeToChange(user_id, messages[-1])]
+            return jsonify({"user_version_tag": messages[-1]["user_version_tag"], "changes": messages}), 200
+
+        last_seen_version_tag = request.headers.get('Last-Event-ID', request.args.get('since'))
+        response = app.response_class(
+            stream_with_context(streamChanges(subscription, current_version_tag, last_seen_version_tag, include_tree)),
+            mimetype='text/event-stream'
+        )
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no' # stop nginx from buffering the stream
+        response.call_on_close(subscription.close) # in case the stream never even got started
+        return response
     except Exception as err:
-        print(f"Error in update_data route: {err}")
+        subscription.close()
+        logEvent(logging.ERROR, "changes_failed", error=str(err), exc_info=err)
         return jsonify({"error": f"Error processing request: {err}"}), 500
 
 
+#MARK: /search
+@app.route('/search', methods=['GET'])
+@useReadReplica
+@token_required
+def search(user_info):
+    # /search?q=dentist&limit=20&offset=0
+    search_text = request.args.get('q', '').strip()
+    if not search_text:
+        return jsonify({"error": "q is required"}), 400
+    if len(search_text) > SEARCH_MAX_QUERY_CHARS:
+        return jsonify({"error": f"q can be at most {SEARCH_MAX_QUERY_CHARS} characters"}), 400
+    try:
+        limit = int(request.args.get('limit', '20'))
+        offset = int(request.args.get('offset', '0'))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be numbers"}), 400
+    if not 1 <= limit <= SEARCH_MAX_LIMIT or offset < 0:
+        return jsonify({"error": f"limit must be 1-{SEARCH_MAX_LIMIT} and offset can't be negative"}), 400
+
+    try:
+        dialect_name = db.session.get_bind().dialect.name
+        if dialect_name not in SEARCH_QUERIES:
+            return jsonify({"error": f"search isn't supported on {dialect_name}"}), 501
+        user_db_id = lookupUserDbId(user_info)
+        if user_db_id is None:
+            return jsonify({"results": [], "limit": limit, "offset": offset, "next_offset": None}), 200
+        results, has_more = searchUserData(user_db_id, search_text, limit, offset)
+        return jsonify({
+            "results": results,
+            "limit": limit,
+            "offset": offset,
+            "next_offset": offset + limit if has_more else None
+        }), 200
+    except Exception as err:
+        db.session.rollback()
+        logEvent(logging.ERROR, "search_failed", error=str(err), exc_info=err)
+        return jsonify({"error": f"Error processing request: {err}"}), 500
+
+
+#MARK: /metrics
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'message': 'Invalid metrics token'}), 401
+    return app.response_class(renderMetrics(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def home():
     return "Welcome to GentaAPI"
@@ -568,5 +2972,6 @@ def home():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        runMigrations(db.engine)
     #app.run(debug=True)
     app.run(debug=True, host="localhost", port=6969)
\ No newline at end of file
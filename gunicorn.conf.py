@@ -0,0 +1,24 @@
+# Production server settings, picked up automatically by `gunicorn app:app` when run from this folder
+# /changes keeps one mostly idle connection open per signed in device. With gunicorn's default sync worker every one of
+# those ties up a whole worker process (and a whole thread with gthread), so for lots of devices set
+# GUNICORN_WORKER_CLASS=gevent (needs `pip install "gunicorn[gevent]"`, see requirements.txt): each request is then a
+# greenlet, waiting on a change costs a few KB instead of a thread, and one worker can hold thousands
+# Under gevent app.py switches mysql-connector to its pure python implementation (see buildEngineOptions)
+# since the C extension's socket calls can't be patched and would block the whole worker on every query
+# Database access is still limited by DB_POOL_SIZE/DB_MAX_OVERFLOW and the admission control settings, not by this file
+# Gunicorn (n.d.) Settings https://docs.gunicorn.org/en/stable/settings.html
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+# sync is gunicorn's own default, so a plain `gunicorn app:app` deploy without gevent installed keeps booting
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+# the built in change_broker only reaches clients connected to the same process, so stay on 1 worker
+# until it's swapped for a shared one (see "Change notifications" in the README)
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+# max open connections per worker (only used by gevent), idle /changes streams count towards this
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '5000'))
+# with gevent this is how long a worker can go without checking in, not a per request limit,
+# so /changes streams (CHANGES_MAX_STREAM_SECONDS) aren't cut off by it
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
@@ -0,0 +1,34 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+def loadApp(monkeypatch, **env):
+    # app.py reads all of its config from env vars at import time, so every test gets its own fresh copy of the module
+    # (otherwise the first test to import it would decide the database/replica/etc for every other test)
+    monkeypatch.setenv('LOG_LEVEL', 'WARNING')
+    monkeypatch.setenv('ADMISSION_CONTROL', 'false')
+    for name in ('DATABASE_REPLICA_URI', 'DB_REPLICA_HOST', 'ADMISSION_REDIS_URL', 'GOOGLE_CLIENT_ID'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+
+    spec = importlib.util.spec_from_file_location('app', APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, 'app', module)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    # app.py with a throwaway sqlite file as its database and an app context pushed
+    module = loadApp(monkeypatch, DATABASE_URI=f"sqlite:///{tmp_path / 'app.db'}")
+    with module.app.app_context():
+        module.db.create_all()
+        yield module
+        module.db.session.remove()
+        for engine in module.db.engines.values():
+            engine.dispose()
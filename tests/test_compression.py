@@ -0,0 +1,59 @@
+import gzip
+import json
+
+HEADERS = {'Authorization': 'Bearer token'}
+
+def seedBigUser(app):
+    # a body well over COMPRESSION_MIN_BYTES
+    user_db_id = app.getUserDataFromDB('google-user')['user_db_id']
+    events = [{'title': f'event {i}', 'collapsed': False, 'dueDate': '2025-01-01', 'notes': 'notes ' * 20, 'todoShown': True, 'notesShown': True, 'todo': []} for i in range(20)]
+    assert app.editDatabase(user_db_id, [{'projectTitle': 'p', 'dueDate': '2025-01-01', 'events': events}], []) == "SUCCESS"
+    app.db.session.commit()
+
+def test_cached_body_is_compressed_once_per_version(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'verify_google_token', lambda token: {'user_id': 'google-user', 'email': 'user@example.com'})
+    seedBigUser(app_module)
+    compressed_bodies = []
+    compressBody = app_module.compressBody
+    def countingCompressBody(body, encoding):
+        compressed_bodies.append(encoding)
+        return compressBody(body, encoding)
+    monkeypatch.setattr(app_module, 'compressBody', countingCompressBody)
+
+    client = app_module.app.test_client()
+    plain = client.get('/get-data', headers=HEADERS)
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed_bodies == []
+
+    gzip_headers = {**HEADERS, 'Accept-Encoding': 'gzip'}
+    responses = [client.get('/get-data', headers=gzip_headers) for _ in range(3)]
+    assert compressed_bodies == ['gzip']
+    assert app_module.snapshot_cache.stats()['compressed_hits'] == 2
+    for response in responses:
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert response.headers['ETag'].startswith('W/')
+        assert json.loads(gzip.decompress(response.get_data())) == plain.get_json()
+
+    # the weak ETag still gets a 304
+    not_modified = client.get('/get-data', headers={**gzip_headers, 'If-None-Match': responses[0].headers['ETag']})
+    assert not_modified.status_code == 304
+
+    # a save drops the compressed copy along with the raw one
+    version_tag = plain.get_json()['user_version_tag']
+    assert client.post('/update-data', headers=HEADERS, json={'user_version_tag': version_tag, 'projects': []}).status_code == 200
+    response = client.get('/get-data', headers=gzip_headers)
+    assert 'Content-Encoding' not in response.headers # an empty tree is under COMPRESSION_MIN_BYTES
+    assert response.get_json()['projects'] == []
+
+def test_cache_budget_counts_compressed_copies(app_module):
+    cache = app_module.ResponseSnapshotCache(1000)
+    cache.put('a', 'v1', b'x' * 600)
+    cache.putCompressed('a', 'v1', 'gzip', b'y' * 100)
+    assert cache.stats()['bytes'] == 700
+    # a compressed copy for an older version isn't kept
+    cache.putCompressed('a', 'v0', 'br', b'z' * 10)
+    assert cache.getCompressed('a', 'v0', 'br') is None
+    cache.put('b', 'v1', b'x' * 350)
+    assert cache.get('a', 'v1') is None
+    assert cache.stats()['bytes'] == 350
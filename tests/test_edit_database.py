@@ -0,0 +1,276 @@
+import copy
+import random
+from datetime import date
+
+# editDatabase() was rewritten to use dict lookups + batched inserts instead of nested loops and a flush per new row
+# this checks the rewrite still saves exactly what the old version did, by running both on the same random trees/edits
+
+def referenceEditDatabase(app, user_db_id, projects_from_client_list, existing_projects_list_from_db):
+    # the original (pre-rewrite) editDatabase, kept as-is apart from comments/prints so there's something to compare to
+    db, Project, Event, Todo = app.db, app.Project, app.Event, app.Todo
+    processed_project_ids_from_client = set()
+
+    for project_client_data in projects_from_client_list:
+        existing_project_in_db = None
+        current_project_id_in_db = None
+
+        if project_client_data.get('id') != None:
+            existing_project_in_db = None
+            for project in existing_projects_list_from_db:
+                if project.id == project_client_data['id']:
+                    existing_project_in_db = project
+                    break
+            if existing_project_in_db == None:
+                return f"ERROR: Project with ID {project_client_data['id']} is not found in db for user"
+
+            current_project_id_in_db = existing_project_in_db.id
+            updated = False
+            if project_client_data.get('projectTitle') != existing_project_in_db.projectTitle:
+                existing_project_in_db.projectTitle = project_client_data['projectTitle']
+                updated = True
+            if isinstance(project_client_data.get('dueDate'), str):
+                client_due_date_obj = date.fromisoformat(project_client_data['dueDate'])
+            else:
+                client_due_date_obj = project_client_data.get('dueDate')
+            if client_due_date_obj != existing_project_in_db.dueDate:
+                existing_project_in_db.dueDate = client_due_date_obj
+                updated = True
+            if updated:
+                db.session.add(existing_project_in_db)
+            processed_project_ids_from_client.add(current_project_id_in_db)
+        else:
+            if isinstance(project_client_data.get('dueDate'), str):
+                client_due_date_obj = date.fromisoformat(project_client_data['dueDate'])
+            else:
+                client_due_date_obj = project_client_data.get('dueDate')
+            new_project = Project(
+                userId = user_db_id,
+                projectTitle = project_client_data['projectTitle'],
+                dueDate = client_due_date_obj
+            )
+            db.session.add(new_project)
+            db.session.flush()
+            current_project_id_in_db = new_project.id
+            processed_project_ids_from_client.add(current_project_id_in_db)
+
+        events_from_client = project_client_data.get('events', [])
+        if existing_project_in_db:
+            existing_events_in_db_for_project = existing_project_in_db.events
+        else:
+            existing_events_in_db_for_project = []
+        processed_event_ids_for_proj = set()
+
+        for event_client_data in events_from_client:
+            existing_event_in_db = None
+            if event_client_data.get('id') != None:
+                existing_event_in_db = None
+                for event in existing_events_in_db_for_project:
+                    if event.id == event_client_data['id']:
+                        existing_event_in_db = event
+                        break
+                if existing_event_in_db == None:
+                    return f"ERROR: event with ID {event_client_data['id']} is not found in table projects w id: {current_project_id_in_db}"
+
+                current_event_id_in_db = existing_event_in_db.id
+                updated = False
+                if isinstance(event_client_data['dueDate'], str):
+                    client_event_due_date_obj = date.fromisoformat(event_client_data['dueDate'])
+                else:
+                    client_event_due_date_obj = event_client_data['dueDate']
+                if event_client_data.get('title') != existing_event_in_db.title:
+                    existing_event_in_db.title = event_client_data['title']
+                    updated = True
+                if event_client_data.get('collapsed') != existing_event_in_db.collapsed:
+                    existing_event_in_db.collapsed = event_client_data['collapsed']
+                    updated = True
+                if client_event_due_date_obj != existing_event_in_db.dueDate:
+                    existing_event_in_db.dueDate = client_event_due_date_obj
+                    updated = True
+                if event_client_data.get('notes') != existing_event_in_db.notes:
+                    existing_event_in_db.notes = event_client_data['notes']
+                    updated = True
+                if event_client_data.get('todoShown') != existing_event_in_db.todoShown:
+                    existing_event_in_db.todoShown = event_client_data['todoShown']
+                    updated = True
+                if event_client_data.get('notesShown') != existing_event_in_db.notesShown:
+                    existing_event_in_db.notesShown = event_client_data['notesShown']
+                    updated = True
+                if updated:
+                    db.session.add(existing_event_in_db)
+                processed_event_ids_for_proj.add(current_event_id_in_db)
+            else:
+                if isinstance(event_client_data['dueDate'], str):
+                    client_event_due_date_obj = date.fromisoformat(event_client_data['dueDate'])
+                else:
+                    client_event_due_date_obj = event_client_data['dueDate']
+                new_event = Event(
+                    projectId=current_project_id_in_db,
+                    title=event_client_data['title'],
+                    collapsed=event_client_data['collapsed'],
+                    dueDate=client_event_due_date_obj,
+                    notes=event_client_data.get('notes'),
+                    todoShown=event_client_data['todoShown'],
+                    notesShown=event_client_data['notesShown']
+                )
+                db.session.add(new_event)
+                db.session.flush()
+                current_event_id_in_db = new_event.id
+                processed_event_ids_for_proj.add(current_event_id_in_db)
+
+            todos_from_client = event_client_data.get('todo', [])
+            if existing_event_in_db:
+                existing_todos_in_db_for_event = existing_event_in_db.todos
+            else:
+                existing_todos_in_db_for_event = []
+            processed_todos_for_proj = set()
+
+            for todo_client_data in todos_from_client:
+                existing_todo_in_db = None
+                if todo_client_data.get('id') != None:
+                    existing_todo_in_db = None
+                    for todo in existing_todos_in_db_for_event:
+                        if todo.id == todo_client_data['id']:
+                            existing_todo_in_db = todo
+                            break
+                    if existing_todo_in_db == None:
+                        return f"ERROR: todo with id {todo_client_data['id']} cannot be found"
+
+                    current_todo_id_in_db = existing_todo_in_db.id
+                    updated = False
+                    if todo_client_data.get('checked') != existing_todo_in_db.checked:
+                        existing_todo_in_db.checked = todo_client_data['checked']
+                        updated = True
+                    if todo_client_data.get('content') != existing_todo_in_db.content:
+                        existing_todo_in_db.content = todo_client_data['content']
+                        updated = True
+                    if updated:
+                        db.session.add(existing_todo_in_db)
+                    processed_todos_for_proj.add(current_todo_id_in_db)
+                else:
+                    new_todo = Todo(
+                        eventId=current_event_id_in_db,
+                        content=todo_client_data.get('content'),
+                        checked=todo_client_data['checked']
+                    )
+                    db.session.add(new_todo)
+
+            for existing_todo_item in existing_todos_in_db_for_event:
+                if existing_todo_item.id not in processed_todos_for_proj:
+                    db.session.delete(existing_todo_item)
+
+        for existing_event_item in existing_events_in_db_for_project:
+            if existing_event_item.id not in processed_event_ids_for_proj:
+                db.session.delete(existing_event_item)
+
+    for existing_project_item in existing_projects_list_from_db:
+        if existing_project_item.id not in processed_project_ids_from_client:
+            db.session.delete(existing_project_item)
+
+    try:
+        db.session.commit()
+        return "SUCCESS"
+    except Exception as err:
+        db.session.rollback()
+        return f"Database update failed: {err}"
+
+def randomEvent(rng):
+    return {
+        'title': f'e{rng.randint(0, 5)}',
+        'collapsed': rng.random() < .5,
+        'dueDate': f'2025-02-0{rng.randint(1, 9)}',
+        'notes': rng.choice([None, 'a', 'b']),
+        'todoShown': rng.random() < .5,
+        'notesShown': rng.random() < .5,
+        'todo': [{'checked': rng.random() < .5, 'content': rng.choice(['x', 'y', None])} for _ in range(rng.randint(0, 4))],
+    }
+
+def randomTree(rng):
+    return [
+        {'projectTitle': f'p{rng.randint(0, 5)}', 'dueDate': f'2025-0{rng.randint(1, 9)}-01', 'events': [randomEvent(rng) for _ in range(rng.randint(0, 4))]}
+        for _ in range(rng.randint(0, 4))
+    ]
+
+def mutateTree(tree, rng):
+    # the kind of edits a client sends: changed fields, deleted rows, new rows, and every so often an id that isn't theirs
+    tree = copy.deepcopy(tree)
+    for project in list(tree):
+        roll = rng.random()
+        if roll < .1:
+            tree.remove(project)
+            continue
+        if roll < .2:
+            project['projectTitle'] += 'X'
+        if rng.random() < .05:
+            project['id'] = 999999
+        for event in list(project['events']):
+            roll = rng.random()
+            if roll < .1:
+                project['events'].remove(event)
+                continue
+            if roll < .3:
+                event['notes'] = 'changed'
+                event['collapsed'] = not event['collapsed']
+                event['dueDate'] = '2026-01-01'
+            if rng.random() < .03:
+                event['id'] = 888888
+            for todo in list(event['todo']):
+                roll = rng.random()
+                if roll < .15:
+                    event['todo'].remove(todo)
+                    continue
+                if roll < .4:
+                    todo['checked'] = not todo['checked']
+                if rng.random() < .03:
+                    todo['id'] = 777777
+            if rng.random() < .3:
+                event['todo'].append({'checked': False, 'content': 'new'})
+        if rng.random() < .3:
+            project['events'].append(randomEvent(rng))
+    if rng.random() < .3:
+        tree.extend(randomTree(rng))
+    # moving an event to another project isn't allowed, both versions should refuse it
+    if len(tree) >= 2 and tree[0]['events'] and rng.random() < .05:
+        tree[1]['events'].append(tree[0]['events'].pop())
+    return tree
+
+def withoutIds(projects):
+    # the two versions hand out ids in a different order so only the contents (in order) get compared
+    return [
+        {**{k: v for k, v in project.items() if k not in ('id', 'events')}, 'events': [
+            {**{k: v for k, v in event.items() if k not in ('id', 'todo')}, 'todo': [
+                {k: v for k, v in todo.items() if k != 'id'} for todo in event['todo']
+            ]} for event in project['events']
+        ]} for project in projects
+    ]
+
+def saveWith(app, use_reference, seed_tree, seed):
+    db = app.db
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    user_db_id = app.getUserDataFromDB('google-user')['user_db_id']
+    assert app.editDatabase(user_db_id, seed_tree, []) == "SUCCESS"
+    db.session.commit()
+    db.session.expire_all()
+
+    edited_tree = mutateTree(app.getUserDataFromDB('google-user')['projects'], random.Random(seed))
+    if use_reference:
+        result = referenceEditDatabase(app, user_db_id, edited_tree, app.Project.query.filter_by(userId=user_db_id).all())
+    else:
+        result = app.editDatabase(user_db_id, edited_tree, app.loadUserTreeFromDB(user_db_id))
+        if result == "SUCCESS":
+            db.session.commit()
+    db.session.rollback()
+    db.session.expire_all()
+    return result == "SUCCESS", withoutIds(app.getUserDataFromDB('google-user')['projects'])
+
+def test_edit_database_matches_reference(app_module):
+    rejected = 0
+    for trial in range(200):
+        seed_tree = randomTree(random.Random(trial))
+        expected = saveWith(app_module, True, seed_tree, trial * 7 + 1)
+        actual = saveWith(app_module, False, seed_tree, trial * 7 + 1)
+        assert actual == expected, f"trial {trial}"
+        rejected += not expected[0]
+    # make sure the bad id/moved event cases actually came up
+    assert 0 < rejected < 200
@@ -0,0 +1,40 @@
+from datetime import date, timedelta
+
+def test_get_data_error_is_json(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'verify_google_token', lambda token: {'user_id': 'google-user', 'email': 'user@example.com'})
+    def failingGetUserData(*args, **kwargs):
+        raise RuntimeError("db went away")
+    monkeypatch.setattr(app_module, 'getUserDataFromDB', failingGetUserData)
+
+    response = app_module.app.test_client().get('/get-data', headers={'Authorization': 'Bearer token'})
+    assert response.status_code == 500
+    assert response.get_json() == {"error": "Error processing request: db went away"}
+
+def test_days_window_etag_changes_with_the_date(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'verify_google_token', lambda token: {'user_id': 'google-user', 'email': 'user@example.com'})
+    real_today = date.today()
+    class FakeDate(date):
+        current = real_today
+        @classmethod
+        def today(cls):
+            return cls.current
+    monkeypatch.setattr(app_module, 'date', FakeDate)
+
+    user_db_id = app_module.getUserDataFromDB('google-user')['user_db_id']
+    event = {'title': 'soon', 'collapsed': False, 'dueDate': str(real_today + timedelta(days=3)), 'notes': None, 'todoShown': True, 'notesShown': True, 'todo': []}
+    assert app_module.editDatabase(user_db_id, [{'projectTitle': 'p', 'dueDate': str(real_today), 'events': [event]}], []) == "SUCCESS"
+    app_module.db.session.commit()
+
+    client = app_module.app.test_client()
+    headers = {'Authorization': 'Bearer token'}
+    response = client.get('/get-data?days=2', headers=headers)
+    assert response.get_json()['projects'] == []
+    etag = response.headers['ETag']
+    assert client.get('/get-data?days=2', headers={**headers, 'If-None-Match': etag}).status_code == 304
+
+    # next day the event is inside the window, the old ETag mustn't turn that into a 304
+    FakeDate.current = real_today + timedelta(days=1)
+    response = client.get('/get-data?days=2', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [e['title'] for p in response.get_json()['projects'] for e in p['events']] == ['soon']
+    assert response.headers['ETag'] != etag
@@ -0,0 +1,141 @@
+import datetime
+import json
+import time
+
+import pytest
+
+pytest.importorskip('cryptography')
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+# Everything here runs offline: a locally generated RSA key pair stands in for Google's signing keys
+# and a fake transport serves its certificate in place of the real cert endpoint
+
+CLIENT_ID = 'test-client-id'
+
+class FakeCertEndpoint:
+    def __init__(self, certs, max_age):
+        self.certs = certs
+        self.max_age = max_age
+        self.calls = []
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=None, **kwargs):
+        self.calls.append(url)
+        return FakeResponse(200, {'Cache-Control': f'public, max-age={self.max_age}'}, json.dumps(self.certs).encode())
+
+class FakeResponse:
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+class ShiftedClock:
+    # stands in for the time module inside app.py so the caches can be moved forward without sleeping
+    def __init__(self):
+        self.offset = 0
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def time(self):
+        return time.time() + self.offset
+
+    def monotonic(self):
+        return time.monotonic() + self.offset
+
+@pytest.fixture(scope='module')
+def signer_and_certs():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'test')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(1).not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    signer = crypt.RSASigner.from_string(private_pem, key_id='test-key')
+    return signer, {'test-key': cert.public_bytes(serialization.Encoding.PEM).decode()}
+
+@pytest.fixture
+def google(app_module, monkeypatch, signer_and_certs):
+    signer, certs = signer_and_certs
+    endpoint = FakeCertEndpoint(certs, max_age=100)
+    clock = ShiftedClock()
+    monkeypatch.setattr(app_module, 'GOOGLE_CLIENT_ID', CLIENT_ID)
+    monkeypatch.setattr(app_module, 'time', clock)
+    monkeypatch.setattr(app_module.google_request, 'transport', endpoint)
+
+    def makeToken(sub, expires_in=3600, issuer='accounts.google.com'):
+        now = int(time.time())
+        claims = {'iss': issuer, 'aud': CLIENT_ID, 'sub': sub, 'email': f'{sub}@example.com', 'iat': now - 10, 'exp': now + expires_in}
+        return jwt.encode(signer, claims).decode()
+
+    return app_module, endpoint, clock, makeToken
+
+def test_certs_are_reused_until_max_age(google):
+    app, endpoint, clock, makeToken = google
+    assert app.verify_google_token(makeToken('a')) == {'user_id': 'a', 'email': 'a@example.com'}
+    assert app.verify_google_token(makeToken('b'))['user_id'] == 'b'
+    assert len(endpoint.calls) == 1
+    assert app.google_auth_cache_stats['cert_misses'] == 1
+    assert app.google_auth_cache_stats['cert_hits'] == 1
+
+    clock.offset = 101
+    assert app.verify_google_token(makeToken('c'))['user_id'] == 'c'
+    assert len(endpoint.calls) == 2
+    assert app.google_auth_cache_stats['cert_misses'] == 2
+
+def test_verified_token_is_cached(google, monkeypatch):
+    app, endpoint, clock, makeToken = google
+    token = makeToken('a')
+    assert app.verify_google_token(token)['user_id'] == 'a'
+
+    # a cache hit shouldn't go anywhere near the signature check
+    def failIfCalled(*args, **kwargs):
+        raise AssertionError("token was verified again")
+    monkeypatch.setattr(app.id_token, 'verify_token', failIfCalled)
+    assert app.verify_google_token(token) == {'user_id': 'a', 'email': 'a@example.com'}
+    assert app.google_auth_cache_stats['token_misses'] == 1
+    assert app.google_auth_cache_stats['token_hits'] == 1
+
+def test_cached_token_is_dropped_at_exp(google):
+    app, endpoint, clock, makeToken = google
+    token = makeToken('a', expires_in=60)
+    assert app.verify_google_token(token)['user_id'] == 'a'
+    assert len(app.verified_token_cache.entries) == 1
+    assert app.verified_token_cache.get(token) is not None
+
+    clock.offset = 61
+    assert app.verified_token_cache.get(token) is None
+    assert len(app.verified_token_cache.entries) == 0
+
+def test_cache_is_bounded(google):
+    app, endpoint, clock, makeToken = google
+    app.verified_token_cache.max_size = 2
+    tokens = [makeToken(sub) for sub in ('a', 'b', 'c')]
+    for token in tokens:
+        app.verify_google_token(token)
+    assert len(app.verified_token_cache.entries) == 2
+    assert app.verified_token_cache.get(tokens[0]) is None
+    assert app.verified_token_cache.get(tokens[2]) is not None
+
+@pytest.mark.parametrize('token_args', [
+    {'issuer': 'https://evil.example.com'},
+    {'expires_in': -3600},
+])
+def test_bad_tokens_are_rejected_and_not_cached(google, token_args):
+    app, endpoint, clock, makeToken = google
+    token = makeToken('a', **token_args)
+    assert app.verify_google_token(token) is None
+    assert app.verify_google_token(token) is None
+    assert len(app.verified_token_cache.entries) == 0
+    assert app.google_auth_cache_stats['token_misses'] == 2
+    assert app.google_auth_cache_stats['token_hits'] == 0
+
+def test_tampered_token_is_rejected(google):
+    app, endpoint, clock, makeToken = google
+    token = makeToken('a')
+    header, payload, signature = token.split('.')
+    assert app.verify_google_token(f"{header}.{payload}.{signature[:-4]}AAAA") is None
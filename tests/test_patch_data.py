@@ -0,0 +1,53 @@
+import pytest
+
+@pytest.fixture
+def patch(app_module, monkeypatch):
+    # posts one patch for a fresh user and returns the response
+    monkeypatch.setattr(app_module, 'verify_google_token', lambda token: {'user_id': 'google-user', 'email': 'user@example.com'})
+    client = app_module.app.test_client()
+    def sendPatch(operations):
+        version_tag = client.get('/get-data', headers={'Authorization': 'Bearer token'}).get_json()['user_version_tag']
+        return client.post('/patch-data', headers={'Authorization': 'Bearer token'}, json={'user_version_tag': version_tag, 'operations': operations})
+    return sendPatch
+
+def test_creates_with_temp_ids(patch):
+    response = patch([
+        {'op': 'create', 'type': 'project', 'tempId': 'p', 'fields': {'projectTitle': 'p', 'dueDate': '2025-01-01'}},
+        {'op': 'create', 'type': 'event', 'parentTempId': 'p', 'tempId': 'e', 'fields': {'title': 'e', 'dueDate': '2025-01-02', 'collapsed': True}},
+        {'op': 'create', 'type': 'todo', 'parentTempId': 'e', 'tempId': 't', 'fields': {'content': None}},
+    ])
+    assert response.status_code == 200
+    assert sorted(response.get_json()['createdIds']) == ['e', 'p', 't']
+
+def test_temp_ids_match_as_strings(patch):
+    # createdIds keys are strings, so a numeric tempId can be referred to either way
+    response = patch([
+        {'op': 'create', 'type': 'project', 'tempId': 1, 'fields': {'projectTitle': 'p', 'dueDate': '2025-01-01'}},
+        {'op': 'create', 'type': 'event', 'parentTempId': '1', 'tempId': '2', 'fields': {'title': 'e', 'dueDate': '2025-01-02'}},
+        {'op': 'create', 'type': 'todo', 'parentTempId': 2, 'fields': {'content': 'x'}},
+    ])
+    assert response.status_code == 200
+    assert sorted(response.get_json()['createdIds']) == ['1', '2']
+
+@pytest.mark.parametrize('operations, message', [
+    ([{'op': 'create', 'type': 'project', 'tempId': 1, 'fields': {'projectTitle': 'p', 'dueDate': '2025-01-01'}},
+      {'op': 'create', 'type': 'project', 'tempId': '1', 'fields': {'projectTitle': 'p', 'dueDate': '2025-01-01'}}], 'reuses tempId 1'),
+    # same tempId on a project and an event would collide in createdIds
+    ([{'op': 'create', 'type': 'project', 'tempId': 'x', 'fields': {'projectTitle': 'p', 'dueDate': '2025-01-01'}},
+      {'op': 'create', 'type': 'event', 'parentTempId': 'x', 'tempId': 'x', 'fields': {'title': 'e', 'dueDate': '2025-01-01'}}], 'reuses tempId x'),
+    ([{'op': 'update', 'type': 'todo', 'id': '5', 'fields': {}}], 'id must be an integer'),
+    ([{'op': 'delete', 'type': 'todo', 'id': True}], 'id must be an integer'),
+    ([{'op': 'create', 'type': 'event', 'parentId': [1], 'fields': {'title': 'e', 'dueDate': '2025-01-01'}}], 'parentId must be an integer'),
+    ([{'op': 'update', 'type': 'project', 'id': 1, 'fields': {'projectTitle': None}}], "projectTitle can't be null"),
+    ([{'op': 'update', 'type': 'event', 'id': 1, 'fields': {'collapsed': None}}], "collapsed can't be null"),
+    ([{'op': 'update', 'type': 'event', 'id': 1, 'fields': {'todoShown': 'yes'}}], 'todoShown must be true or false'),
+    ([{'op': 'update', 'type': 'event', 'id': 1, 'fields': {'title': 5}}], 'title must be a string'),
+    ([{'op': 'update', 'type': 'event', 'id': 1, 'fields': {'title': 'x' * 256}}], 'title is longer than 255 characters'),
+    ([{'op': 'update', 'type': 'project', 'id': 1, 'fields': {'dueDate': 20250101}}], 'dueDate must be a date string'),
+    ([{'op': 'create', 'type': 'project', 'fields': {'projectTitle': 'p', 'dueDate': 'tomorrow'}}], 'dueDate must be a date string'),
+    ([{'op': 'update', 'type': 'todo', 'id': 1, 'fields': {'checked': 1}}], 'checked must be true or false'),
+])
+def test_bad_operations_are_400(patch, operations, message):
+    response = patch(operations)
+    assert response.status_code == 400
+    assert message in response.get_json()['error']
@@ -0,0 +1,83 @@
+import shutil
+import sqlite3
+
+import pytest
+
+from conftest import loadApp
+
+# The primary and the replica are two separate sqlite files, so which one a query went to can be checked by
+# looking at what ended up in each file (nothing replicates between them unless the test copies the file over)
+
+@pytest.fixture
+def replicated_app(tmp_path, monkeypatch):
+    primary_path, replica_path = tmp_path / 'primary.db', tmp_path / 'replica.db'
+    module = loadApp(monkeypatch, DATABASE_URI=f'sqlite:///{primary_path}', DATABASE_REPLICA_URI=f'sqlite:///{replica_path}')
+    monkeypatch.setattr(module, 'verify_google_token', lambda token: {'user_id': 'google-user', 'email': 'user@example.com'})
+    with module.app.app_context():
+        module.db.create_all()
+        # the models have no bind key so create_all only makes the primary's tables, on a real replica replication does this
+        module.db.metadata.create_all(module.db.engines['replica'])
+        yield module, primary_path, replica_path
+        module.db.session.remove()
+        for engine in module.db.engines.values():
+            engine.dispose()
+
+def countRows(path, table):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        connection.close()
+
+def replicate(app, primary_path, replica_path):
+    # "replication caught up": the replica becomes a copy of the primary
+    app.db.engines['replica'].dispose()
+    shutil.copy(primary_path, replica_path)
+    app.snapshot_cache.clear()
+
+HEADERS = {'Authorization': 'Bearer token'}
+PROJECT = {'projectTitle': 'p', 'dueDate': '2025-01-01', 'events': []}
+
+def test_replica_is_configured(replicated_app):
+    app, primary_path, replica_path = replicated_app
+    assert set(app.db.engines) == {None, 'replica'}
+    assert app.db.engines['replica'].url.database == str(replica_path)
+
+def test_new_user_is_created_on_the_primary(replicated_app):
+    app, primary_path, replica_path = replicated_app
+    response = app.app.test_client().get('/get-data', headers=HEADERS)
+    assert response.status_code == 200
+    assert response.get_json()['projects'] == []
+    assert countRows(primary_path, 'users') == 1
+    assert countRows(replica_path, 'users') == 0
+
+def test_reads_go_to_the_replica_and_writes_to_the_primary(replicated_app):
+    app, primary_path, replica_path = replicated_app
+    client = app.app.test_client()
+    version_tag = client.get('/get-data', headers=HEADERS).get_json()['user_version_tag']
+    response = client.post('/update-data', headers=HEADERS, json={'user_version_tag': version_tag, 'projects': [PROJECT]})
+    assert response.status_code == 200
+    assert countRows(primary_path, 'projects') == 1
+    assert countRows(replica_path, 'projects') == 0
+
+    # change the replica's copy so a read that went to it can be told apart from one that went to the primary
+    replicate(app, primary_path, replica_path)
+    connection = sqlite3.connect(replica_path)
+    connection.execute("UPDATE projects SET projectTitle = 'from-replica'")
+    connection.commit()
+    connection.close()
+
+    data = client.get('/get-data', headers=HEADERS).get_json()
+    assert [project['projectTitle'] for project in data['projects']] == ['from-replica']
+
+    # the save (version check included) still goes to the primary
+    response = client.post('/update-data', headers=HEADERS, json={'user_version_tag': data['user_version_tag'], 'projects': []})
+    assert response.status_code == 200
+    assert countRows(primary_path, 'projects') == 0
+    assert countRows(replica_path, 'projects') == 1
+
+def test_reads_outside_replica_routes_use_the_primary(replicated_app):
+    app, primary_path, replica_path = replicated_app
+    app.app.test_client().get('/get-data', headers=HEADERS)
+    # no request marked with @useReadReplica, so this sees the primary's user even though the replica is empty
+    assert app.User.query.filter_by(googleId='google-user').first() is not None
@@ -0,0 +1,81 @@
+import pytest
+
+HEADERS = {'Authorization': 'Bearer token'}
+
+def makeEvent(title, notes=None, todos=()):
+    return {'title': title, 'collapsed': False, 'dueDate': '2025-01-01', 'notes': notes, 'todoShown': True, 'notesShown': True,
+            'todo': [{'checked': False, 'content': content} for content in todos]}
+
+def saveTree(app, user_google_id, projects):
+    user_db_id = app.getUserDataFromDB(user_google_id)['user_db_id']
+    assert app.editDatabase(user_db_id, projects, app.loadUserTreeFromDB(user_db_id)) == "SUCCESS"
+    app.db.session.commit()
+    app.db.session.expire_all()
+    return app.getUserDataFromDB(user_google_id)['projects']
+
+@pytest.fixture
+def search(app_module, monkeypatch):
+    # the FTS5 tables and their triggers come from migration 3
+    app_module.runMigrations(app_module.db.engine)
+    signed_in = {'user_id': 'google-user'}
+    monkeypatch.setattr(app_module, 'verify_google_token', lambda token: {'user_id': signed_in['user_id'], 'email': 'user@example.com'})
+    client = app_module.app.test_client()
+    def runSearch(query, as_user='google-user', **params):
+        signed_in['user_id'] = as_user
+        return client.get('/search', headers=HEADERS, query_string={'q': query, **params})
+    return app_module, runSearch
+
+def seedUsers(app):
+    saveTree(app, 'other-user', [{'projectTitle': 'theirs', 'dueDate': '2025-01-01', 'events': [makeEvent('dentist secret', 'dentist dentist dentist')]}])
+    return saveTree(app, 'google-user', [{'projectTitle': 'mine', 'dueDate': '2025-01-01', 'events': [
+        makeEvent('dentist', 'dentist appointment, bring the dentist forms'),
+        makeEvent('groceries', 'milk and eggs', todos=['call the dentist', 'buy milk']),
+        makeEvent('dentist checkup'),
+        makeEvent('gym'),
+    ]}])
+
+def test_results_are_ranked_and_paginated(search):
+    app, runSearch = search
+    projects = seedUsers(app)
+    everything = runSearch('dentist', limit=100).get_json()
+    results = everything['results']
+    assert everything['next_offset'] is None
+    assert {(result['type'], result['text'] or result['eventTitle']) for result in results} == {
+        ('event', 'dentist appointment, bring the dentist forms'), ('event', 'dentist checkup'), ('todo', 'call the dentist'),
+    }
+    scores = [result['score'] for result in results]
+    assert scores == sorted(scores, reverse=True)
+    # the event that says dentist the most comes first
+    assert results[0]['id'] == projects[0]['events'][0]['id']
+
+    first_page = runSearch('dentist', limit=2).get_json()
+    assert first_page['next_offset'] == 2
+    second_page = runSearch('dentist', limit=2, offset=2).get_json()
+    assert second_page['next_offset'] is None
+    assert first_page['results'] + second_page['results'] == results
+
+def test_other_users_rows_never_come_back(search):
+    app, runSearch = search
+    seedUsers(app)
+    assert runSearch('secret').get_json()['results'] == []
+    other_user_event_ids = {event['id'] for project in app.getUserDataFromDB('other-user')['projects'] for event in project['events']}
+    assert not {result['eventId'] for result in runSearch('dentist', limit=100).get_json()['results']} & other_user_event_ids
+    assert [result['eventTitle'] for result in runSearch('secret', as_user='other-user').get_json()['results']] == ['dentist secret']
+
+def test_index_follows_edit_database_updates_and_deletes(search):
+    app, runSearch = search
+    projects = seedUsers(app)
+    projects[0]['events'][2]['title'] = 'orthodontist checkup'
+    del projects[0]['events'][1] # groceries, with its todos
+    saveTree(app, 'google-user', projects)
+
+    assert [result['eventTitle'] for result in runSearch('dentist').get_json()['results']] == ['dentist']
+    assert [result['eventTitle'] for result in runSearch('orthodontist').get_json()['results']] == ['orthodontist checkup']
+    assert runSearch('milk').get_json()['results'] == []
+
+def test_unsupported_database_is_501(search, monkeypatch):
+    app, runSearch = search
+    monkeypatch.setattr(app, 'SEARCH_QUERIES', {'mysql': app.MYSQL_SEARCH_QUERY})
+    response = runSearch('dentist')
+    assert response.status_code == 501
+    assert response.get_json() == {"error": "search isn't supported on sqlite"}
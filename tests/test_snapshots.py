@@ -0,0 +1,42 @@
+import json
+
+def seedUser(app):
+    user_data = app.getUserDataFromDB('google-user')
+    projects = [{'projectTitle': 'p', 'dueDate': '2025-01-01', 'events': [
+        {'title': 'e', 'collapsed': False, 'dueDate': '2025-01-02', 'notes': None, 'todoShown': True, 'notesShown': False, 'todo': [{'checked': True, 'content': 'x'}]}
+    ]}]
+    assert app.editDatabase(user_data['user_db_id'], projects, []) == "SUCCESS"
+    app.db.session.commit()
+    return user_data['user_db_id'], user_data['user_version_tag']
+
+def test_document_does_not_depend_on_debug(app_module):
+    user_db_id, user_version_tag = seedUser(app_module)
+    app_module.app.debug = False
+    document = app_module.buildUserDocument(user_db_id, user_version_tag)
+    app_module.app.debug = True
+    try:
+        assert app_module.buildUserDocument(user_db_id, user_version_tag) == document
+    finally:
+        app_module.app.debug = False
+    assert document.endswith("\n")
+    assert json.loads(document) == app_module.getUserDataFromDB('google-user')
+
+def test_check_snapshots_compares_parsed_json(app_module):
+    user_db_id, _ = seedUser(app_module)
+    app_module.rebuildUserSnapshot(user_db_id)
+    runner = app_module.app.test_cli_runner()
+    assert runner.invoke(args=['check-snapshots']).exit_code == 0
+
+    # same data written with other whitespace (e.g. by a debug build) still matches
+    snapshot = app_module.db.session.get(app_module.UserSnapshot, user_db_id)
+    snapshot.document = json.dumps(json.loads(snapshot.document), indent=2)
+    app_module.db.session.commit()
+    assert runner.invoke(args=['check-snapshots']).exit_code == 0
+
+    # different data doesn't
+    snapshot = app_module.db.session.get(app_module.UserSnapshot, user_db_id)
+    snapshot.document = snapshot.document.replace('"p"', '"changed"')
+    app_module.db.session.commit()
+    result = runner.invoke(args=['check-snapshots'])
+    assert result.exit_code == 1
+    assert "document does not match the tables" in result.output